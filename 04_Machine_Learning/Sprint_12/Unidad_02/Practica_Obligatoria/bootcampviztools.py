@@ -2,36 +2,71 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 
-def pinta_distribucion_categoricas(df, columnas_categoricas, relativa=False, mostrar_valores=False):
+def _anota_barras(ax, **kwargs):
+    # Escribe el valor de cada barra con ax.bar_label, una llamada por grupo de barras (contenedor) en vez de un annotate por barra
+    for contenedor in ax.containers:
+        ax.bar_label(contenedor, fmt='%.2f', padding=3, **kwargs)
+
+
+def cuenta_categoricas(df, columnas_categoricas, relativa=False, top_n=None, etiqueta_otros='Otros', n_jobs=None):
+    """
+    Calcula las frecuencias de varias columnas categóricas de una vez, con un único value_counts por columna.
+
+    Args:
+    df (pandas.DataFrame): DataFrame que contiene los datos.
+    columnas_categoricas (list): Columnas de las que se quieren las frecuencias.
+    relativa (bool, opcional): Si es True, devuelve frecuencias relativas (value_counts(normalize=True)). Por defecto es False.
+    top_n (int, opcional): Si se indica, conserva las top_n categorías más frecuentes de cada columna y agrupa el resto en una
+        única barra etiqueta_otros, para que las columnas con mucha cardinalidad no pinten miles de barras. Por defecto None (todas).
+    etiqueta_otros (str, opcional): Nombre de la categoría que agrupa al resto cuando se usa top_n. Por defecto 'Otros'.
+    n_jobs (int, opcional): Número de hilos con los que contar las columnas en paralelo. Por defecto None (secuencial).
+
+    Returns:
+    dict: Diccionario columna -> pandas.Series de frecuencias ordenadas de mayor a menor.
+    """
+
+    def cuenta(col):
+        serie = df[col].value_counts(normalize=relativa)
+        if top_n is not None and len(serie) > top_n:
+            resto = serie.iloc[top_n:].sum()
+            serie = pd.concat([serie.iloc[:top_n], pd.Series([resto], index=[etiqueta_otros])])
+            serie.name = col
+        return serie
+
+    if n_jobs is not None and n_jobs > 1 and len(columnas_categoricas) > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            series = list(executor.map(cuenta, columnas_categoricas))
+    else:
+        series = [cuenta(col) for col in columnas_categoricas]
+
+    return dict(zip(columnas_categoricas, series))
+
+
+def pinta_distribucion_categoricas(df, columnas_categoricas, relativa=False, mostrar_valores=False, top_n=None, n_jobs=None):
     num_columnas = len(columnas_categoricas)
     num_filas = (num_columnas // 2) + (num_columnas % 2)
 
     fig, axes = plt.subplots(num_filas, 2, figsize=(15, 5 * num_filas))
     axes = axes.flatten() 
 
+    # Cuenta todas las columnas de una vez (relativas con normalize=True), agrupando en 'Otros' lo que quede fuera del top_n
+    frecuencias = cuenta_categoricas(df, columnas_categoricas, relativa=relativa, top_n=top_n, n_jobs=n_jobs)
+
     for i, col in enumerate(columnas_categoricas):
         ax = axes[i]
-        if relativa:
-            total = df[col].value_counts().sum()
-            serie = df[col].value_counts().apply(lambda x: x / total)
-            sns.barplot(x=serie.index, y=serie, ax=ax, palette='viridis', hue = serie.index, legend = False)
-            ax.set_ylabel('Frecuencia Relativa')
-        else:
-            serie = df[col].value_counts()
-            sns.barplot(x=serie.index, y=serie, ax=ax, palette='viridis', hue = serie.index, legend = False)
-            ax.set_ylabel('Frecuencia')
+        serie = frecuencias[col]
+        sns.barplot(x=serie.index, y=serie, ax=ax, palette='viridis', hue = serie.index, legend = False)
+        ax.set_ylabel('Frecuencia Relativa' if relativa else 'Frecuencia')
 
         ax.set_title(f'Distribución de {col}')
         ax.set_xlabel('')
         ax.tick_params(axis='x', rotation=45)
 
         if mostrar_valores:
-            for p in ax.patches:
-                height = p.get_height()
-                ax.annotate(f'{height:.2f}', (p.get_x() + p.get_width() / 2., height), 
-                            ha='center', va='center', xytext=(0, 9), textcoords='offset points')
+            _anota_barras(ax)
 
     for j in range(i + 1, num_filas * 2):
         axes[j].axis('off')
@@ -40,24 +75,54 @@ def pinta_distribucion_categoricas(df, columnas_categoricas, relativa=False, mos
     plt.show()
 
 
-def plot_categorical_relationship_fin(df, cat_col1, cat_col2, relative_freq=False, show_values=False, size_group = 5):
-    # Prepara los datos
-    count_data = df.groupby([cat_col1, cat_col2]).size().reset_index(name='count')
-    total_counts = df[cat_col1].value_counts()
-    
-    # Convierte a frecuencias relativas si se solicita
+def tabla_contingencia(df, cat_col1, cat_col2, relative_freq=False):
+    """
+    Construye la tabla de contingencia densa entre dos columnas categóricas con una sola pasada de np.bincount.
+
+    Args:
+    df (pandas.DataFrame): DataFrame que contiene los datos.
+    cat_col1 (str): Columna de las filas de la tabla (ordenadas, como en groupby).
+    cat_col2 (str): Columna de las columnas de la tabla (ordenadas, como en groupby).
+    relative_freq (bool, opcional): Si es True, divide cada fila por el total de su categoría de cat_col1. Por defecto es False.
+
+    Returns:
+    pandas.DataFrame: Tabla con las categorías de cat_col1 como índice y las de cat_col2 como columnas.
+    """
+    codigos1, categorias1 = pd.factorize(df[cat_col1], sort=True)
+    codigos2, categorias2 = pd.factorize(df[cat_col2], sort=True)
+
+    # Codifica cada par (cat_col1, cat_col2) como un único entero y cuenta todos los pares a la vez, ignorando los nulos (código -1)
+    validos = (codigos1 >= 0) & (codigos2 >= 0)
+    codigo_par = codigos1[validos] * len(categorias2) + codigos2[validos]
+    matriz = np.bincount(codigo_par, minlength=len(categorias1) * len(categorias2)).reshape(len(categorias1), len(categorias2))
+
     if relative_freq:
-        count_data['count'] = count_data.apply(lambda x: x['count'] / total_counts[x[cat_col1]], axis=1)
+        # El total de cada categoría de cat_col1 incluye las filas con cat_col2 nulo, igual que value_counts()
+        totales = np.bincount(codigos1[codigos1 >= 0], minlength=len(categorias1))
+        matriz = matriz / totales[:, None]
+
+    return pd.DataFrame(matriz, index=pd.Index(categorias1, name=cat_col1), columns=pd.Index(categorias2, name=cat_col2))
+
+
+def _contingencia_a_largo(tabla):
+    # Pasa (un trozo de) la tabla de contingencia al formato largo que espera seaborn, sin los pares que no aparecen en los datos
+    largo = tabla.stack().reset_index(name='count')
+    return largo[largo['count'] > 0]
+
+
+def plot_categorical_relationship_fin(df, cat_col1, cat_col2, relative_freq=False, show_values=False, size_group = 5):
+    # Prepara los datos: una única tabla de contingencia, ya normalizada si se piden frecuencias relativas
+    tabla = tabla_contingencia(df, cat_col1, cat_col2, relative_freq=relative_freq)
 
     # Si hay más de size_group categorías en cat_col1, las divide en grupos de size_group
-    unique_categories = df[cat_col1].unique()
+    unique_categories = tabla.index
     if len(unique_categories) > size_group:
         num_plots = int(np.ceil(len(unique_categories) / size_group))
 
         for i in range(num_plots):
-            # Selecciona un subconjunto de categorías para cada gráfico
+            # Selecciona un subconjunto de filas de la tabla para cada gráfico
             categories_subset = unique_categories[i * size_group:(i + 1) * size_group]
-            data_subset = count_data[count_data[cat_col1].isin(categories_subset)]
+            data_subset = _contingencia_a_largo(tabla.iloc[i * size_group:(i + 1) * size_group])
 
             # Crea el gráfico
             plt.figure(figsize=(10, 6))
@@ -71,17 +136,14 @@ def plot_categorical_relationship_fin(df, cat_col1, cat_col2, relative_freq=Fals
 
             # Mostrar valores en el gráfico
             if show_values:
-                for p in ax.patches:
-                    ax.annotate(f'{p.get_height():.2f}', (p.get_x() + p.get_width() / 2., p.get_height()),
-                                ha='center', va='center', fontsize=10, color='black', xytext=(0, size_group),
-                                textcoords='offset points')
+                _anota_barras(ax, fontsize=10, color='black')
 
             # Muestra el gráfico
             plt.show()
     else:
         # Crea el gráfico para menos de size_group categorías
         plt.figure(figsize=(10, 6))
-        ax = sns.barplot(x=cat_col1, y='count', hue=cat_col2, data=count_data)
+        ax = sns.barplot(x=cat_col1, y='count', hue=cat_col2, data=_contingencia_a_largo(tabla))
 
         # Añade títulos y etiquetas
         plt.title(f'Relación entre {cat_col1} y {cat_col2}')
@@ -91,10 +153,7 @@ def plot_categorical_relationship_fin(df, cat_col1, cat_col2, relative_freq=Fals
 
         # Mostrar valores en el gráfico
         if show_values:
-            for p in ax.patches:
-                ax.annotate(f'{p.get_height():.2f}', (p.get_x() + p.get_width() / 2., p.get_height()),
-                            ha='center', va='center', fontsize=10, color='black', xytext=(0, size_group),
-                            textcoords='offset points')
+            _anota_barras(ax, fontsize=10, color='black')
 
         # Muestra el gráfico
         plt.show()
@@ -133,10 +192,7 @@ def plot_categorical_numerical_relationship(df, categorical_col, numerical_col,
 
             # Mostrar valores en el gráfico
             if show_values:
-                for p in ax.patches:
-                    ax.annotate(f'{p.get_height():.2f}', (p.get_x() + p.get_width() / 2., p.get_height()),
-                                ha='center', va='center', fontsize=10, color='black', xytext=(0, 5),
-                                textcoords='offset points')
+                _anota_barras(ax, fontsize=10, color='black')
 
             # Muestra el gráfico
             plt.show()
@@ -153,10 +209,7 @@ def plot_categorical_numerical_relationship(df, categorical_col, numerical_col,
 
         # Mostrar valores en el gráfico
         if show_values:
-            for p in ax.patches:
-                ax.annotate(f'{p.get_height():.2f}', (p.get_x() + p.get_width() / 2., p.get_height()),
-                            ha='center', va='center', fontsize=10, color='black', xytext=(0, 5),
-                            textcoords='offset points')
+            _anota_barras(ax, fontsize=10, color='black')
 
         # Muestra el gráfico
         plt.show()
@@ -225,7 +278,7 @@ def plot_grouped_histograms(df, cat_col, num_col, group_size):
 
 
 
-def grafico_dispersion_con_correlacion(df, columna_x, columna_y, tamano_puntos=50, mostrar_correlacion=False):
+def grafico_dispersion_con_correlacion(df, columna_x, columna_y, tamano_puntos=50, mostrar_correlacion=False, estadisticos=None):
     """
     Crea un diagrama de dispersión entre dos columnas y opcionalmente muestra la correlación.
 
@@ -235,13 +288,20 @@ def grafico_dispersion_con_correlacion(df, columna_x, columna_y, tamano_puntos=5
     columna_y (str): Nombre de la columna para el eje Y.
     tamano_puntos (int, opcional): Tamaño de los puntos en el gráfico. Por defecto es 50.
     mostrar_correlacion (bool, opcional): Si es True, muestra la correlación en el gráfico. Por defecto es False.
+    estadisticos (EstadisticosCorrelacion, opcional): Caché de momentos de toolbox_ML de la que sale la correlación.
+        Pasando la misma a varios gráficos sobre el mismo df, los momentos de cada columna se calculan una sola vez;
+        por defecto se calculan en cada llamada.
     """
 
     plt.figure(figsize=(10, 6))
     sns.scatterplot(data=df, x=columna_x, y=columna_y, s=tamano_puntos)
 
     if mostrar_correlacion:
-        correlacion = df[[columna_x, columna_y]].corr().iloc[0, 1]
+        if estadisticos is None:
+            # Import aquí: este módulo se usa también suelto, sin toolbox_ML al lado
+            from toolbox_ML import EstadisticosCorrelacion
+            estadisticos = EstadisticosCorrelacion(df)
+        correlacion, _ = estadisticos.correlacion(columna_x, columna_y)
         plt.title(f'Diagrama de Dispersión con Correlación: {correlacion:.2f}')
     else:
         plt.title('Diagrama de Dispersión')
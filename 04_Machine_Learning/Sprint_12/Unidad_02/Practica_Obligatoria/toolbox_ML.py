@@ -1,7 +1,9 @@
+import weakref
+
 import numpy as np
 import pandas as pd
 
-from scipy.stats import f_oneway, mannwhitneyu, pearsonr
+from scipy.stats import f_oneway, mannwhitneyu, t as t_student
 
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -203,9 +205,115 @@ def check_parametros(df:pd.DataFrame, target_col:str, umbral_corr = 0.5, umbral_
             return None
     return 'OK'
 
+## ESTADÍSTICOS DE CORRELACIÓN ##
+
+class EstadisticosCorrelacion:
+    '''
+    Caché de momentos por columna (n, media y suma de cuadrados centrada) de un DataFrame, a partir de los cuales se calcula
+    el coeficiente de correlación de Pearson entre pares de columnas sin guardar copias de los datos ni construir la matriz
+    completa de .corr().
+
+    Cada columna se recorre una sola vez para obtener sus momentos; para cada par sólo se calcula el producto cruzado centrado.
+    Si alguna de las dos columnas tiene nulos, los momentos se recalculan sobre las filas completas del par (como hace .corr()).
+
+    Para reutilizar los momentos entre varias llamadas (p. ej. un panel de gráficos de dispersión), se crea una instancia y se
+    pasa como estadisticos= a get_features_num_regression y grafico_dispersion_con_correlacion; sin ella, cada llamada usa
+    una caché propia y recalcula.
+
+    Argumentos:
+    df (DataFrame): DataFrame del que se calcularán las correlaciones. Se guarda una referencia débil, no una copia.
+
+    Cada momento se guarda junto con la posición en memoria de los datos de su columna: si la columna se reasigna
+    (df['b'] = -df['b']), se detecta y se recalcula. Las modificaciones in situ (df.loc[0, 'b'] = 5) no cambian esa
+    posición, así que tras ellas hay que llamar a invalidar().
+    '''
+
+    def __init__(self, df:pd.DataFrame):
+        self._df = weakref.ref(df)
+        self._momentos = {}
+        self._correlaciones = {}
+
+    @property
+    def df(self):
+        return self._df()
+
+    def invalidar(self, columna=None):
+        '''
+        Descarta los momentos y correlaciones cacheados, de todas las columnas o sólo de la indicada.
+        '''
+        if columna is None:
+            self._momentos.clear()
+            self._correlaciones.clear()
+        else:
+            self._momentos.pop(columna, None)
+            self._correlaciones = {par: r for par, r in self._correlaciones.items() if columna not in par}
+
+    def _valores(self, columna:str):
+        '''
+        Devuelve los valores de una columna como array float y su firma (posición en memoria, forma y tipo de sus datos),
+        o None como firma si pandas tiene que copiarlos para devolverlos (entonces no se puede saber si han cambiado).
+        '''
+        datos = self.df[columna].to_numpy()
+        firma = None if datos.flags.owndata else (datos.__array_interface__['data'][0], datos.shape, datos.strides, datos.dtype.str)
+        return datos.astype(float, copy=False), firma
+
+    def momentos(self, columna:str):
+        '''
+        Devuelve la tupla (valores, n, media, m2, firma) de una columna, reutilizando los momentos mientras sus datos no cambien.
+        m2 es la suma de los cuadrados de las desviaciones respecto a la media. Los valores no se guardan en la caché.
+        '''
+        valores, firma = self._valores(columna)
+        guardado = self._momentos.get(columna)
+        if guardado is None or firma is None or guardado[3] != firma:
+            validos = valores[~np.isnan(valores)]
+            n = len(validos)
+            media = validos.mean() if n else np.nan
+            m2 = np.dot(validos - media, validos - media) if n else np.nan
+            guardado = (n, media, m2, firma)
+            self._momentos[columna] = guardado
+        return (valores, *guardado)
+
+    def correlacion(self, columna_x:str, columna_y:str):
+        '''
+        Devuelve una tupla (r, n) con el coeficiente de correlación de Pearson entre dos columnas y el número de filas usadas.
+        '''
+        par = (columna_x, columna_y) if columna_x <= columna_y else (columna_y, columna_x)
+        x, n_x, media_x, m2_x, firma_x = self.momentos(columna_x)
+        y, n_y, media_y, m2_y, firma_y = self.momentos(columna_y)
+        firmas = (firma_x, firma_y) if columna_x <= columna_y else (firma_y, firma_x)
+
+        guardado = self._correlaciones.get(par)
+        if guardado is None or None in firmas or guardado[2] != firmas:
+            # Con nulos en alguna de las columnas, sólo cuentan las filas completas del par
+            if n_x != len(x) or n_y != len(y):
+                completas = ~(np.isnan(x) | np.isnan(y))
+                x, y = x[completas], y[completas]
+                n_x = len(x)
+                media_x, media_y = x.mean(), y.mean()
+                m2_x, m2_y = np.dot(x - media_x, x - media_x), np.dot(y - media_y, y - media_y)
+
+            cruzado = np.dot(x - media_x, y - media_y)
+            denominador = np.sqrt(m2_x * m2_y)
+            r = cruzado / denominador if n_x > 1 and denominador > 0 else np.nan
+            guardado = (float(np.clip(r, -1, 1)), n_x, firmas)
+            self._correlaciones[par] = guardado
+        return guardado[:2]
+
+    def pearson(self, columna_x:str, columna_y:str):
+        '''
+        Devuelve una tupla (r, pvalor) equivalente a scipy.stats.pearsonr, reutilizando los momentos cacheados.
+        '''
+        r, n = self.correlacion(columna_x, columna_y)
+        if n <= 2 or np.isnan(r):
+            return r, np.nan
+        if abs(r) == 1:
+            return r, 0.0
+        estadistico = r * np.sqrt((n - 2) / (1 - r**2))
+        return r, float(2 * t_student.sf(abs(estadistico), n - 2))
+
 ## VARIABLES NUMÉRICAS ##
 
-def get_features_num_regression(df, target_col, umbral_corr, pvalue=None):
+def get_features_num_regression(df, target_col, umbral_corr, pvalue=None, estadisticos=None):
     """
     Devuelve una lista de columnas numéricas cuya correlación con target supera el umbral de correlación.
     Si especifica 'pvalue', tambien verifica que la correlación sea significativa.
@@ -215,6 +323,8 @@ def get_features_num_regression(df, target_col, umbral_corr, pvalue=None):
     target_col (str): Nombre de la columna objetivo (debe ser numérica y con alta cardinalidad).
     umbral_corr (float): Umbral de correlación (entre 0 y 1).
     pvalue (float, optional): Nivel de significancia deseado (por ejemplo 0.05). Por defecto None.
+    estadisticos (EstadisticosCorrelacion, optional): Caché de momentos del DataFrame, para compartirla con otras llamadas.
+        Por defecto se crea una nueva en cada llamada.
     
     Retorna:
     list or None: Lista de nombres de columnas que cumplen los criterios. Imprime errores si no es válido.
@@ -229,11 +339,13 @@ def get_features_num_regression(df, target_col, umbral_corr, pvalue=None):
     ###Selecciona todas las columnas numéricas excepto la columna objetivo.
     num_cols = df.select_dtypes(include=[np.number]).columns.drop(target_col)
 
-    ###Para cada columna numérica: Crea un sub-DataFrame con solo la columna objetivo y la actual, Elimina filas con NaN y Calcula la correlación de Pearson y      su p-value.
+    ###Para cada columna numérica: Calcula la correlación de Pearson y su p-value sobre las filas sin NaN, a partir de los momentos
+    ###de cada columna (los de target_col se calculan una sola vez), sin crear un sub-DataFrame por columna.
 
+    if estadisticos is None:
+        estadisticos = EstadisticosCorrelacion(df)
     for col in num_cols:
-        series = df[[target_col, col]].dropna()
-        corr, pval = pearsonr(series[target_col], series[col])
+        corr, pval = estadisticos.pearson(target_col, col)
         
     ### Si la correlación es suficientemente fuerte (positiva o negativa) y si el pvalue (si se usa) indica significancia estadística. Entonces se guarda el        nombre de la columna.
 
@@ -447,7 +559,23 @@ def plot_features_cat_regression(df, target_col = '', columns=[], pvalue=0.05, w
         sns.histplot(df, x=target_col, hue=columna, ax=ax[index], log_scale=escala_log)
 
 ## RELACIÓN MULTIVARIANTES ##
-def plot_target_vs_features(df:pd.DataFrame, target:str, features_cat:list, features_num:list):
+
+def _pinta_celdas_target_vs_features(axs, df, target, features_cat, features_num, rasterizar=False):
+    '''
+    Rellena un grid de axes (filas: numéricas, columnas: categóricas) con los scatterplots de plot_target_vs_features.
+    '''
+    for i, categoria in enumerate(features_cat):
+        for j, numerica in enumerate(features_num):
+            sns.scatterplot(df, y=numerica, x=target, hue=categoria, ax=axs[j,i], rasterized=rasterizar);
+            
+            axs[j,i].set_xlabel('')             # Eliminamos etiqueta del eje X, correspondiente al target
+            label = numerica if i == 0 else ''  # Configuramos para mostrar la etiqueta del eje Y solamente en el primer gráfico, ya que hace referencia a toda la fila
+            axs[j,i].set_ylabel(label)          # Mostramos la etiqueta del eje Y,que tomará valor nulo ('') para los subplots interiores
+            axs[j,i].legend(frameon=False)      # Configuramos la leyenda para que no muestre el título ni el borde, así ocupará menos y reducimos la osibilidad que se superponga
+        axs[0,i].set_title(categoria)           # Agregamos el nombre de la categoría correspondiente a cada columna, para ello, la mostramos como título en el primer subplot
+
+def plot_target_vs_features(df:pd.DataFrame, target:str, features_cat:list, features_num:list, filas_por_pagina=None, columnas_por_pagina=None,
+                            max_puntos=None, rasterizar=False, ruta_paginas=None, figsize=(15,15)):
     '''
     Genera graficos de dispersión entre la variable target y otras variables numéricas del DataFrame que presenten una correlación significativa.
     Además distingue categorías de las variables pre-seleccionadas del dataset.
@@ -468,6 +596,20 @@ def plot_target_vs_features(df:pd.DataFrame, target:str, features_cat:list, feat
 
     features_num (list): Lista de variables numéricas pre-selecionadas
 
+    filas_por_pagina (int): None por defecto. Si se indica (o se indica columnas_por_pagina), el grid se pinta por páginas de como mucho
+    filas_por_pagina x columnas_por_pagina subplots en lugar de en una única figura, de modo que la memoria no crece con el número de features.
+
+    columnas_por_pagina (int): None por defecto. Número máximo de variables categóricas (columnas del grid) por página.
+
+    max_puntos (int): None por defecto. Si se indica, cada subplot pinta una misma muestra aleatoria de como mucho max_puntos filas del dataset.
+
+    rasterizar (bool): False por defecto. Si es True, los puntos se guardan como imagen dentro de cada subplot, lo que aligera las figuras y los ficheros vectoriales.
+
+    ruta_paginas (str): None por defecto. Plantilla de ruta con el campo {pagina} (por ejemplo 'graficos/target_{pagina}.png'). Si se indica en modo paginado,
+    cada página se guarda en disco reutilizando la misma figura y los mismos axes; si no, cada página se muestra en pantalla y se cierra.
+
+    figsize (tuple): (15,15) por defecto. Tamaño de la figura (o de cada página).
+
     RETURN:
 
     Muestra en pantala un grid con gráficos de dispersión cruzando las variables numericas (filas, eje Y) con el target (eje X) y 
@@ -475,24 +617,62 @@ def plot_target_vs_features(df:pd.DataFrame, target:str, features_cat:list, feat
     
     '''
 
-    # Generamos una figura con un grid de subplots tal que cada fila represente una variable numérica, y cada columna represente una variable categórica. 
-    # Además, el eje X de cada subplot será compartido (representará la variable target) 
+    # Si se pide, submuestreamos una sola vez el dataset, de forma que todas las celdas pintan los mismos puntos
 
-    fig, axs = plt.subplots(len(features_num), len(features_cat), figsize=(15,15), sharex=True)
+    if max_puntos is not None and len(df) > max_puntos:
+        df = df.sample(n=max_puntos, random_state=42)
 
-    # Realizamos una doble iteración: primero recorremos las variables categóricas (columnas del grid), y posteriormente las numéricas (filas del grid),
-    # generando en cada una un scatterplot de seaborn asignado a cada subplot (celda) del grid. 
-    # El eje Y viene representado por la variable numérica y el eje X por el target, mientras que la categórica determinará el color de cada punto. 
-    # Por último ajustamos el gráfico para simplificarlo visualmente (se comentan los ajustes en cada línea).
+    if filas_por_pagina is None and columnas_por_pagina is None:
 
-    for i, categoria in enumerate(features_cat):
-        for j, numerica in enumerate(features_num):
-            sns.scatterplot(df, y=numerica, x=target, hue=categoria, ax=axs[j,i]);
-            
-            axs[j,i].set_xlabel('')             # Eliminamos etiqueta del eje X, correspondiente al target
-            label = numerica if i == 0 else ''  # Configuramos para mostrar la etiqueta del eje Y solamente en el primer gráfico, ya que hace referencia a toda la fila
-            axs[j,i].set_ylabel(label)          # Mostramos la etiqueta del eje Y,que tomará valor nulo ('') para los subplots interiores
-            axs[j,i].legend(frameon=False)      # Configuramos la leyenda para que no muestre el título ni el borde, así ocupará menos y reducimos la osibilidad que se superponga
-        axs[0,i].set_title(categoria)           # Agregamos el nombre de la categoría correspondiente a cada columna, para ello, la mostramos como título en el primer subplot
-    fig.suptitle(target, fontsize=16)           # Agregamos como título general de la figura el nombre del target, representado en todos los ejes X
-    fig.tight_layout()                          # Por último ajustamos todos los elementos para que no se solapen y la figura quede más compacta
\ No newline at end of file
+        # Generamos una figura con un grid de subplots tal que cada fila represente una variable numérica, y cada columna represente una variable categórica. 
+        # Además, el eje X de cada subplot será compartido (representará la variable target) 
+
+        fig, axs = plt.subplots(len(features_num), len(features_cat), figsize=figsize, sharex=True, squeeze=False)
+
+        # Realizamos una doble iteración: primero recorremos las variables categóricas (columnas del grid), y posteriormente las numéricas (filas del grid),
+        # generando en cada una un scatterplot de seaborn asignado a cada subplot (celda) del grid. 
+        # El eje Y viene representado por la variable numérica y el eje X por el target, mientras que la categórica determinará el color de cada punto. 
+        # Por último ajustamos el gráfico para simplificarlo visualmente (se comentan los ajustes en cada línea).
+
+        _pinta_celdas_target_vs_features(axs, df, target, features_cat, features_num, rasterizar)
+        fig.suptitle(target, fontsize=16)           # Agregamos como título general de la figura el nombre del target, representado en todos los ejes X
+        fig.tight_layout()                          # Por último ajustamos todos los elementos para que no se solapen y la figura quede más compacta
+        return
+
+    # Modo paginado: recorremos el grid completo por bloques (tiles) de filas_por_pagina x columnas_por_pagina
+
+    filas_por_pagina = filas_por_pagina or len(features_num)
+    columnas_por_pagina = columnas_por_pagina or len(features_cat)
+
+    fig, axs = None, None
+    pagina = 0
+    for inicio_num in range(0, len(features_num), filas_por_pagina):
+        for inicio_cat in range(0, len(features_cat), columnas_por_pagina):
+            bloque_num = features_num[inicio_num:inicio_num + filas_por_pagina]
+            bloque_cat = features_cat[inicio_cat:inicio_cat + columnas_por_pagina]
+            pagina += 1
+
+            # Al guardar en disco reutilizamos la figura y sus axes entre páginas: sólo limpiamos las celdas, y ocultamos las que sobran en las páginas del borde
+
+            if fig is None or ruta_paginas is None:
+                fig, axs = plt.subplots(filas_por_pagina, columnas_por_pagina, figsize=figsize, sharex=True, squeeze=False)
+            for ax in axs.flat:
+                ax.cla()
+                ax.set_visible(False)
+            for ax in axs[:len(bloque_num), :len(bloque_cat)].flat:
+                ax.set_visible(True)
+
+            _pinta_celdas_target_vs_features(axs, df, target, bloque_cat, bloque_num, rasterizar)
+            for ax in axs[len(bloque_num) - 1, :len(bloque_cat)]:
+                ax.tick_params(labelbottom=True)    # En páginas con menos filas, la última visible muestra las marcas del eje X compartido
+            fig.suptitle(f'{target} - Página {pagina}', fontsize=16)
+            fig.tight_layout()
+
+            if ruta_paginas is None:
+                plt.show()
+                plt.close(fig)
+            else:
+                fig.savefig(ruta_paginas.format(pagina=pagina))
+
+    if ruta_paginas is not None and fig is not None:
+        plt.close(fig)
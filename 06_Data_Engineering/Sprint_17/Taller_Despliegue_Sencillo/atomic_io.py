@@ -0,0 +1,38 @@
+import os
+import threading
+
+
+def fsync_dir(path):
+    """fsync de un directorio: hace duraderas las entradas creadas, renombradas o borradas en él (sólo en POSIX)."""
+    if os.name != 'posix':
+        return
+    fd = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data):
+    """
+    Escribe `data` (bytes o str, que se guarda en UTF-8) en `path`: fichero temporal en el mismo directorio,
+    fsync, os.replace y fsync del directorio. Quien lea `path` ve el contenido anterior o el nuevo, nunca uno
+    a medias, y tras un corte de luz no aparece vacío ni a medio escribir.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    # Un temporal por proceso e hilo: dos escritores a la vez no se pisan el fichero a medio escribir
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    fsync_dir(os.path.dirname(path))
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from atomic_io import atomic_write
+
+# Caché columnar de los CSV de entrenamiento: cada CSV se parsea una sola vez y se guarda como un .npy por
+# columna (tipado, sin parsear texto) en CACHE_DIR/<sha256 del CSV>/. Las siguientes lecturas abren sólo
+# las columnas pedidas con np.load(mmap_mode='r'), así que no se parsea nada y sólo se leen del disco las
+# páginas que se usan. Usa .npy y no Parquet/Feather para no depender de pyarrow.
+#
+# Para no recalcular el hash en cada lectura, index.json guarda por fichero su tamaño, mtime y sha256:
+# mientras el tamaño y el mtime no cambien, se reutiliza el hash sin leer el CSV.
+#
+# Las columnas de texto se guardan como array Unicode de ancho fijo con los nulos en una máscara aparte
+# (col_<i>_nulls.npy), para devolverlos como NaN igual que read_csv y no como el texto 'nan'.
+
+CACHE_DIR = os.environ.get('DATA_CACHE_DIR', '.data_cache')
+CACHE_FORMAT = 2  # Cambia con el formato de las entradas: las de otro formato se reconstruyen
+_HASH_CHUNK = 4 * 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(path, data):
+    atomic_write(path, json.dumps(data, indent=2))
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def _cached_sha256(path, cache_dir):
+    index_path = os.path.join(cache_dir, 'index.json')
+    index = _read_json(index_path, {})
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    entry = index.get(key)
+    if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+        return entry['sha256']
+    sha = file_sha256(path)
+    index[key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': sha}
+    _write_json(index_path, index)
+    return sha
+
+
+def _options(read_csv_kwargs):
+    # Opciones de read_csv tal como quedan guardadas en meta.json, para poder compararlas
+    return json.loads(json.dumps(read_csv_kwargs, sort_keys=True, default=str))
+
+
+def _entry_name(sha, read_csv_kwargs):
+    # El mismo CSV leído con otras opciones de read_csv (p. ej. index_col), o guardado con otro formato, es otra entrada
+    name = f'{sha}-v{CACHE_FORMAT}'
+    if not read_csv_kwargs:
+        return name
+    options = json.dumps(read_csv_kwargs, sort_keys=True, default=str).encode()
+    return f'{name}-{hashlib.sha256(options).hexdigest()[:12]}'
+
+
+def _build(path, entry_dir, cache_dir, **read_csv_kwargs):
+    import pandas as pd  # Sólo hace falta la primera vez que se ve cada versión del CSV
+
+    data = pd.read_csv(path, **read_csv_kwargs)
+    tmp_dir = tempfile.mkdtemp(prefix='building_', dir=cache_dir)
+    columns = []
+    for i, name in enumerate(data.columns):
+        values = data[name].to_numpy()
+        column = {'name': str(name), 'file': f'col_{i}.npy'}
+        if values.dtype == object:
+            nulls = pd.isna(values)
+            if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+                values = np.where(nulls, '', values).astype(str)  # Texto como array Unicode de ancho fijo, que también se puede mapear
+                if nulls.any():
+                    column['nulls'] = f'col_{i}_nulls.npy'
+                    np.save(os.path.join(tmp_dir, column['nulls']), nulls)
+            else:
+                column['pickled'] = True  # Tipos mezclados (p. ej. booleanos con nulos): se guardan tal cual, sin mapear
+        np.save(os.path.join(tmp_dir, column['file']), np.ascontiguousarray(values), allow_pickle=column.get('pickled', False))
+        column['dtype'] = values.dtype.str
+        columns.append(column)
+    meta = {'source': os.path.abspath(path), 'read_csv': _options(read_csv_kwargs), 'rows': len(data), 'columns': columns}
+    _write_json(os.path.join(tmp_dir, 'meta.json'), meta)
+    try:
+        os.rename(tmp_dir, entry_dir)  # Atómico: otro proceso ve la entrada completa o no la ve
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)  # Otro proceso la ha creado a la vez: nos quedamos con la suya
+
+
+def _drop_stale(path, keep, cache_dir, read_csv_kwargs):
+    # Borra las entradas de versiones anteriores del mismo CSV leído con las mismas opciones
+    # (los procesos que aún las tengan mapeadas no se ven afectados)
+    source = os.path.abspath(path)
+    options = _options(read_csv_kwargs)
+    for name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, name)
+        if name == keep or not os.path.isdir(entry_dir) or name.startswith('building_'):
+            continue
+        meta = _read_json(os.path.join(entry_dir, 'meta.json'), {})
+        if meta.get('source') == source and meta.get('read_csv') == options:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+def _load_column(entry_dir, column):
+    pickled = column.get('pickled', False)
+    values = np.load(os.path.join(entry_dir, column['file']), mmap_mode=None if pickled else 'r', allow_pickle=pickled)
+    if 'nulls' in column:
+        values = values.astype(object)
+        values[np.load(os.path.join(entry_dir, column['nulls']))] = np.nan
+    return values
+
+
+def load_columns(path, columns=None, cache_dir=None, **read_csv_kwargs):
+    """
+    Devuelve {columna: array} con las columnas `columns` (todas si es None) del CSV `path`, mapeadas en
+    memoria de solo lectura desde la caché. Si es la primera vez que se ve este contenido del CSV, se
+    parsea con pandas (`read_csv_kwargs` se le pasan tal cual) y se guarda en la caché. Se guardan las
+    columnas, no el índice: con index_col=0 la primera columna simplemente no aparece.
+    Las columnas de texto con nulos (NaN, como en read_csv) y las de tipos mezclados se devuelven en memoria, sin mapear.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    name = _entry_name(_cached_sha256(path, cache_dir), read_csv_kwargs)
+    entry_dir = os.path.join(cache_dir, name)
+    if not os.path.isdir(entry_dir):
+        _build(path, entry_dir, cache_dir, **read_csv_kwargs)
+        _drop_stale(path, name, cache_dir, read_csv_kwargs)
+
+    meta = _read_json(os.path.join(entry_dir, 'meta.json'), None)
+    by_name = {c['name']: c for c in meta['columns']}
+    wanted = list(by_name) if columns is None else list(columns)
+    missing = [name for name in wanted if name not in by_name]
+    if missing:
+        raise KeyError(f"Columns not found in {path}: {', '.join(missing)}")
+    return {name: _load_column(entry_dir, by_name[name]) for name in wanted}
+
+
+def load_frame(path, columns=None, cache_dir=None, **read_csv_kwargs):
+    """Como load_columns, pero devuelve un DataFrame de pandas con esas columnas, en su orden."""
+    import pandas as pd
+
+    return pd.DataFrame(load_columns(path, columns, cache_dir, **read_csv_kwargs), copy=False)
@@ -1,41 +1,72 @@
-import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import train_test_split, cross_validate
 from sklearn.metrics import mean_squared_error, mean_absolute_percentage_error
 from sklearn.linear_model import Lasso
 import pickle
 import os
 
+from artifact import export_linear_model
+from data_cache import load_frame
+from tuning import tune_lasso
+
 os.chdir(os.path.dirname(__file__))
 
-data = pd.read_csv('data/Advertising.csv', index_col=0)
+# Procesos para los folds de la validación cruzada. Con las 200 filas de Advertising cada fold tarda menos que
+# arrancar los procesos de joblib, así que por defecto es 1; con datos grandes, N_JOBS=-1 usa todos los cores
+N_JOBS = int(os.environ.get('N_JOBS', 1))
+# Error de validación cruzada con el que se elige alpha: rmse o mape
+TUNE_CRITERION = os.environ.get('TUNE_CRITERION', 'rmse')
+
+# Caché columnar del CSV (data_cache.py): se parsea la primera vez y después se mapea en memoria
+data = load_frame('data/Advertising.csv', index_col=0)
 
 X_train, X_test, y_train, y_test = train_test_split(data.drop(columns=['sales']),
                                                     data['sales'],
                                                     test_size = 0.20,
                                                     random_state=42)
 
-model = Lasso(alpha=6000)
+# Ajuste de alpha: en cada fold se recorre el camino de regularización completo en una sola resolución
+# (folds en paralelo) y se elige el alpha con menor error medio de CV
+tuning = tune_lasso(X_train, y_train, cv = 4, criterion = TUNE_CRITERION, n_jobs = N_JOBS)
+print("Best alpha: ", tuning["alpha"], f"(CV {TUNE_CRITERION.upper()})")
+if tuning["grid_extensions"]:
+    print(f"  (the grid was extended {tuning['grid_extensions']} time(s) below its smallest alpha)")
+if tuning["best_at_edge"]:
+    print("  Warning: best alpha is at the edge of the grid, the optimum may lie outside it")
 
-cross_val_train_MSE = cross_val_score(model, X_train, y_train, cv = 4, scoring= "neg_mean_squared_error")
-cross_val_train_MAPE = cross_val_score(model, X_train, y_train, cv = 4, scoring= "neg_mean_absolute_percentage_error")
+model = Lasso(alpha=tuning["alpha"])
+
+# Una sola pasada de validación cruzada con las dos métricas: cada fold se entrena una vez y se puntúa con ambas
+cross_val = cross_validate(model, X_train, y_train, cv = 4, n_jobs = N_JOBS,
+                           scoring = {"mse": "neg_mean_squared_error", "mape": "neg_mean_absolute_percentage_error"})
+cross_val_train_MSE = cross_val["test_mse"]
+cross_val_train_MAPE = cross_val["test_mape"]
 mse_cross_val = -np.mean(cross_val_train_MSE)
 rmse_cross_val = np.mean([np.sqrt(-mse_fold) for mse_fold in cross_val_train_MSE])
 mape_cross_val = -np.mean(cross_val_train_MAPE)
 
 model.fit(X_train, y_train)
+y_pred = model.predict(X_test)  # Se predice una vez y se reutiliza para todas las métricas de test
+mse_test = mean_squared_error(y_test, y_pred)
 
 print("Train Mean Sales", y_train.mean())
 print("MSE Cross: ", mse_cross_val)
 print("RMSE Cross: ", rmse_cross_val)
 print("MAPE Cross: ", mape_cross_val)
 print("**********")
-print("MSE Test: ", mean_squared_error(y_test, model.predict(X_test)))
-print("RMSE Test: ", np.sqrt(mean_squared_error(y_test, model.predict(X_test))))
-print("MAPE Test: ", mean_absolute_percentage_error(y_test, model.predict(X_test)))
+print("MSE Test: ", mse_test)
+print("RMSE Test: ", np.sqrt(mse_test))
+print("MAPE Test: ", mean_absolute_percentage_error(y_test, y_pred))
 
 
+# El ajuste final con todos los datos parte de los coeficientes de train (warm start) en lugar de desde cero
+model.set_params(warm_start = True)
 model.fit(data.drop(columns = ["sales"]), data["sales"])
+model.set_params(warm_start = False)  # El modelo guardado conserva los parámetros de siempre
+model.tuning_ = tuning  # Diagnóstico del camino de regularización, se guarda con el modelo y en el artefacto JSON
 
 with open('ad_model.pkl', 'wb') as f:
-    pickle.dump(model, f)
\ No newline at end of file
+    pickle.dump(model, f)
+
+# Artefacto compacto para la API: coeficientes, intercept y orden de features en JSON, que se carga sólo con NumPy
+export_linear_model(model, 'ad_model.json')
@@ -0,0 +1,100 @@
+import warnings
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.linear_model import lasso_path
+from sklearn.model_selection import KFold
+
+# Búsqueda de alpha para el Lasso: en cada fold se calcula el camino de regularización completo con
+# lasso_path (una sola resolución que recorre los alphas de mayor a menor, partiendo cada uno de la
+# solución del anterior) y se puntúan todos los alphas a la vez sobre el fold de validación.
+# Es mucho más barato que un grid de ajustes independientes de Lasso(alpha=...)
+
+CRITERIA = ('rmse', 'mape')
+
+
+def alpha_grid(X, y, n_alphas=100, eps=1e-3):
+    """Alphas de mayor a menor en escala logarítmica, desde el más pequeño que anula todos los coeficientes."""
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    alpha_max = np.abs((X - X.mean(axis=0)).T @ (y - y.mean())).max() / len(y)
+    return np.geomspace(alpha_max, alpha_max * eps, n_alphas)
+
+
+def _centered_path(X, y, alphas):
+    # lasso_path no ajusta intercept: se centran X e y como hace Lasso(fit_intercept=True) y se recupera después
+    mean_x, mean_y = X.mean(axis=0), y.mean()
+    _, coefs, _ = lasso_path(X - mean_x, y - mean_y, alphas=alphas)
+    return coefs, mean_y - mean_x @ coefs  # coefs: (n_features, n_alphas), intercepts: (n_alphas,)
+
+
+def _score_fold(X, y, train_idx, val_idx, alphas):
+    coefs, intercepts = _centered_path(X[train_idx], y[train_idx], alphas)
+    y_val = y[val_idx]
+    residuals = y_val[:, None] - (X[val_idx] @ coefs + intercepts)  # Predicción de todos los alphas a la vez
+    rmse = np.sqrt((residuals ** 2).mean(axis=0))
+    mape = (np.abs(residuals) / np.maximum(np.abs(y_val), np.finfo(np.float64).eps)[:, None]).mean(axis=0)
+    return rmse, mape
+
+
+def _extend_grid(alphas, eps=1e-3):
+    # Otro tramo por debajo del alpha más pequeño, con la misma densidad (alphas por década) que el grid
+    per_decade = (len(alphas) - 1) / np.log10(alphas[0] / alphas[-1])
+    n_more = max(int(round(per_decade * np.log10(1 / eps))), 1)
+    return np.concatenate([alphas, alphas[-1] * np.geomspace(1, eps, n_more + 1)[1:]])
+
+
+def tune_lasso(X, y, cv=4, alphas=None, n_alphas=100, criterion='rmse', n_jobs=None, random_state=42,
+               max_extensions=3):
+    """
+    Elige el alpha del Lasso por validación cruzada con `cv` folds, recorriendo el camino de regularización.
+
+    Los folds se resuelven en paralelo (`n_jobs`, como en sklearn). `criterion` es 'rmse' o 'mape': el
+    alpha elegido es el de menor media de ese error entre folds. Si es el alpha más pequeño del grid, el
+    óptimo puede estar por debajo: se amplía el grid tres décadas hacia abajo y se repite, hasta
+    `max_extensions` veces (el extremo de arriba no se amplía: por encima todos los coeficientes ya son 0).
+    Si aun así queda en el borde, se avisa con un warning y 'best_at_edge' sigue a True.
+
+    Devuelve un diccionario con el alpha elegido y el diagnóstico del camino (media y desviación de RMSE y
+    MAPE por alpha, y los coeficientes de cada alpha ajustados con todos los datos), listo para guardarse en JSON.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"criterion must be one of {CRITERIA}, got {criterion!r}")
+    features = [str(c) for c in getattr(X, 'columns', range(np.shape(X)[1]))]
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    alphas = alpha_grid(X, y, n_alphas) if alphas is None else np.sort(np.asarray(alphas, dtype=np.float64))[::-1]
+
+    extensions = 0
+    while True:
+        folds = KFold(n_splits=cv, shuffle=True, random_state=random_state).split(X)
+        scores = Parallel(n_jobs=n_jobs)(delayed(_score_fold)(X, y, train_idx, val_idx, alphas)
+                                         for train_idx, val_idx in folds)
+        rmse = np.array([fold_rmse for fold_rmse, _ in scores])
+        mape = np.array([fold_mape for _, fold_mape in scores])
+
+        best = int(np.argmin((rmse if criterion == 'rmse' else mape).mean(axis=0)))
+        if best < len(alphas) - 1 or len(alphas) < 2 or extensions >= max_extensions:
+            break
+        alphas = _extend_grid(alphas)
+        extensions += 1
+    if best == len(alphas) - 1 and len(alphas) > 1:
+        warnings.warn(f"Best alpha {alphas[best]:.4g} is still the smallest of the grid after {extensions} "
+                      f"extensions: the optimum may be lower")
+    coefs, intercepts = _centered_path(X, y, alphas)
+    return {
+        'alpha': float(alphas[best]),
+        'criterion': criterion,
+        'cv': cv,
+        'features': features,
+        'alphas': alphas.tolist(),
+        'cv_rmse_mean': rmse.mean(axis=0).tolist(),
+        'cv_rmse_std': rmse.std(axis=0).tolist(),
+        'cv_mape_mean': mape.mean(axis=0).tolist(),
+        'cv_mape_std': mape.std(axis=0).tolist(),
+        'coef_path': coefs.T.tolist(),
+        'intercept_path': intercepts.tolist(),
+        'best_index': best,
+        'best_at_edge': best in (0, len(alphas) - 1),  # Si es un extremo, conviene ampliar el rango de alphas
+        'grid_extensions': extensions,
+    }
@@ -1,64 +1,25 @@
-from flask import Flask, jsonify, request
-import os
-import pickle
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import Lasso
-from sklearn.metrics import mean_squared_error, mean_absolute_percentage_error
-import numpy as np
+from flask import Flask
+
+from serving import ServingCore
 
 # os.chdir(os.path.dirname(__file__))
 
 app = Flask(__name__)
 
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024  # Límite del cuerpo de las peticiones batch
+
+# Núcleo de servicio compartido con la API de Elastic Beanstalk (ver serving.py): registro y almacén de
+# versiones del modelo, agrupador de predicciones, caché, modo sombra, reentrenamiento en segundo plano con los
+# datos nuevos, métricas en /metrics y /healthz y /readyz. Monta las rutas /api/v1/predict*, /api/v1/models*,
+# /api/v1/shadow* y /api/v1/retrain/*; aquí sólo queda la portada
+core = ServingCore(retrain_data='data/Advertising_new.csv')
+core.init_app(app)
+
 
 @app.route("/", methods=["GET"])
 def hello(): # Ligado al endopoint "/" o sea el home, con el método GET
     return "<h1>Bienvenido a mi API del modelo advertising en AWS EC2</h1>"
 
 
-@app.route("/api/v1/predict", methods=["GET"])
-def predict(): # Ligado al endpoint '/api/v1/predict', con el método GET
-    with open('ad_model.pkl', 'rb') as f:
-        model = pickle.load(f)
-
-    tv = request.args.get('tv', None)
-    radio = request.args.get('radio', None)
-    newspaper = request.args.get('newspaper', None)
-
-    print(tv,radio,newspaper)
-    print(type(tv))
-
-    if tv is None or radio is None or newspaper is None:
-        return "Args empty, not enough data to predict"
-    else:
-        prediction = model.predict([[float(tv),float(radio),float(newspaper)]])
-    
-    return jsonify({'predictions': prediction[0]})
-
-
-@app.route("/api/v1/retrain/", methods=["GET"])
-def retrain(): # Ligado al endpoint '/api/v1/retrain/', metodo GET
-    if os.path.exists("data/Advertising_new.csv"):
-        data = pd.read_csv('data/Advertising_new.csv')
-
-        X_train, X_test, y_train, y_test = train_test_split(data.drop(columns=['sales']),
-                                                        data['sales'],
-                                                        test_size = 0.20,
-                                                        random_state=42)
-
-        model = Lasso(alpha=6000)
-        model.fit(X_train, y_train)
-        rmse = np.sqrt(mean_squared_error(y_test, model.predict(X_test)))
-        mape = mean_absolute_percentage_error(y_test, model.predict(X_test))
-        model.fit(data.drop(columns=['sales']), data['sales'])
-        with open('ad_model.pkl', 'wb') as f:
-            pickle.dump(model, f)
-            
-        return f"Model retrained. New evaluation metric RMSE: {str(rmse)}, MAPE: {str(mape)}"
-    else:
-        return f"<h2>New data for retrain NOT FOUND. Nothing done!</h2>"
-    
-
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,59 @@
+import json
+
+import numpy as np
+
+from atomic_io import atomic_write
+
+# Formato de artefacto para modelos lineales: un JSON pequeño con lo necesario para predecir con NumPy,
+# sin importar scikit-learn ni deserializar un objeto genérico con pickle
+ARTIFACT_FORMAT = 'linear-model'
+ARTIFACT_VERSION = 1
+
+
+class LinearArtifactModel:
+    """Modelo lineal cargado de un artefacto JSON: predict(X) = X @ coef + intercept, con las columnas en el orden de `features`."""
+
+    def __init__(self, coef, intercept, features, metadata=None):
+        self.coef_ = np.asarray(coef, dtype=np.float64)
+        self.intercept_ = float(intercept)
+        self.features = list(features)
+        self.metadata = metadata or {}
+
+    def predict(self, X):
+        return np.asarray(X, dtype=np.float64) @ self.coef_ + self.intercept_
+
+
+def export_linear_model(model, path, features=None):
+    """
+    Guarda un modelo lineal de scikit-learn ya entrenado (Lasso, LinearRegression, Ridge...) como artefacto JSON.
+
+    Si el modelo lleva `tuning_` (el diagnóstico de tuning.tune_lasso con el que se eligió alpha), se guarda en 'tuning'.
+    Se escribe con atomic_write (temporal, fsync y rename), así que quien lea `path` nunca ve un JSON a medias.
+    """
+    from importlib.metadata import version
+
+    if features is None:
+        features = [str(f) for f in getattr(model, 'feature_names_in_', range(len(model.coef_)))]
+    artifact = {
+        'format': ARTIFACT_FORMAT,
+        'format_version': ARTIFACT_VERSION,
+        'estimator': type(model).__name__,
+        'params': {k: v for k, v in model.get_params().items() if isinstance(v, (int, float, str, bool, type(None)))},
+        'sklearn_version': version('scikit-learn'),
+        'features': list(features),
+        'coef': np.ravel(model.coef_).tolist(),
+        'intercept': float(np.ravel(model.intercept_)[0]) if np.ndim(model.intercept_) else float(model.intercept_),
+    }
+    if getattr(model, 'tuning_', None) is not None:
+        artifact['tuning'] = model.tuning_
+    atomic_write(path, json.dumps(artifact, indent=2))
+
+
+def load_linear_model(path):
+    """Carga un artefacto JSON de export_linear_model como LinearArtifactModel, usando sólo NumPy."""
+    with open(path) as f:
+        artifact = json.load(f)
+    if artifact.get('format') != ARTIFACT_FORMAT or artifact.get('format_version') != ARTIFACT_VERSION:
+        raise ValueError(f"Unsupported model artifact: {artifact.get('format')} v{artifact.get('format_version')}")
+    metadata = {k: artifact[k] for k in ('estimator', 'params', 'sklearn_version', 'tuning') if k in artifact}
+    return LinearArtifactModel(artifact['coef'], artifact['intercept'], artifact['features'], metadata)
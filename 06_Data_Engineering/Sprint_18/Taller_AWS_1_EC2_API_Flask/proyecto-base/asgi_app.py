@@ -0,0 +1,139 @@
+"""
+Variante asíncrona (ASGI) de la API del modelo advertising, con Quart (la versión async de la API de Flask).
+
+Expone las mismas rutas que app.py y comparte con ella el núcleo de servicio (serving.py): registro y
+almacén de versiones, caché, modo sombra, métricas y /healthz y /readyz. Un cliente lento ya no ocupa un
+worker: mientras espera, el bucle de eventos atiende otras conexiones. La predicción de una fila se hace
+directamente en el bucle (es un producto escalar de 3 coeficientes); los batch de más de
+ASYNC_INLINE_BODY_BYTES (64 KiB), las escrituras en el almacén de modelos (flock y fsync) y el
+reentrenamiento se ejecutan en hilos, sin bloquear el bucle.
+
+Para servirla, con miles de conexiones keep-alive en una sola máquina:
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 2 --timeout-keep-alive 30
+
+(subiendo también el límite de descriptores de fichero, p. ej. `ulimit -n 65535`). Para que /metrics sume los dos
+workers, como con gunicorn.conf.py, se arranca con METRICS_DIR apuntando a un directorio vacío (`rm -rf .metrics`).
+En local se prueba con el cliente de test asíncrono de Quart: `app.test_client()`.
+"""
+import asyncio
+import os
+import time
+
+from quart import Quart, g, jsonify, request, url_for
+
+from serving import ServingCore
+
+app = Quart(__name__)
+
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024  # Límite del cuerpo de las peticiones batch
+
+# El mismo núcleo que app.py, sin el agrupador: en el bucle de eventos la predicción de una fila se hace en
+# línea. Los handlers del núcleo no tocan el framework (devuelven cuerpo y status) y aquí se envuelven en rutas async
+core = ServingCore(coalesce=False, retrain_data='data/Advertising_new.csv')
+
+# Hasta este tamaño un batch se parsea y predice en el bucle (más barato que pasar a un hilo); por encima, en un hilo
+INLINE_BODY_BYTES = int(os.environ.get('ASYNC_INLINE_BODY_BYTES', 64 * 1024))
+
+
+async def in_thread(fn, *args):
+    # Trabajo bloqueante fuera del bucle de eventos, en el pool de hilos por defecto: mientras, se atienden otras conexiones
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+def respond(result):
+    body, *rest = result
+    return (jsonify(body) if isinstance(body, dict) else body, *rest)
+
+
+@app.before_request
+async def start_timer():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+async def record_request(response):
+    endpoint = request.endpoint or 'unmatched'
+    core.request_latency.labels(endpoint, request.method).observe(time.perf_counter() - g.started)
+    if response.status_code >= 400:
+        core.errors.labels(endpoint, response.status_code).inc()
+    return response
+
+
+@app.route("/", methods=["GET"])
+async def hello():
+    return "<h1>Bienvenido a mi API del modelo advertising en AWS EC2</h1>"
+
+
+@app.route("/api/v1/predict", methods=["GET"])
+async def predict():
+    return respond(core.predict_args(request.args))
+
+
+@app.route("/api/v1/predict/stats", methods=["GET"])
+async def predict_stats():
+    return respond(core.predict_stats())
+
+
+@app.route("/api/v1/predict/batch", methods=["POST"])
+async def predict_batch():
+    body = await request.get_data()
+    if len(body) <= INLINE_BODY_BYTES:
+        return respond(core.predict_body(body, request.mimetype))
+    return respond(await in_thread(core.predict_body, body, request.mimetype))
+
+
+@app.route("/api/v1/retrain/", methods=["GET"])
+async def retrain():
+    # El entrenamiento corre en el hilo de JobRunner; el bucle de eventos sólo encola el job y responde
+    return respond(core.retrain(request.args, lambda job_id: url_for('retrain_status', job_id=job_id)))
+
+
+@app.route("/api/v1/retrain/<job_id>", methods=["GET"])
+async def retrain_status(job_id):
+    return respond(core.retrain_status(job_id))
+
+
+@app.route("/api/v1/models", methods=["GET"])
+async def model_versions():
+    return respond(core.model_versions())
+
+
+@app.route("/api/v1/models/rollback", methods=["POST"])
+async def model_rollback():
+    return respond(await in_thread(core.model_rollback, request.args.get('version')))
+
+
+@app.route("/api/v1/shadow", methods=["GET"])
+async def shadow_stats():
+    return respond(core.shadow_stats())
+
+
+@app.route("/api/v1/shadow/promote", methods=["POST"])
+async def shadow_promote():
+    return respond(await in_thread(core.shadow_promote))
+
+
+@app.route("/api/v1/shadow/discard", methods=["POST"])
+async def shadow_discard():
+    return respond(await in_thread(core.shadow_discard))
+
+
+@app.route("/healthz", methods=["GET"])
+async def health():
+    return respond(core.health())
+
+
+@app.route("/readyz", methods=["GET"])
+async def readiness():
+    return respond(core.readiness())
+
+
+@app.route("/metrics", methods=["GET"])
+async def prometheus_metrics():
+    return respond(core.render_metrics())
+
+
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -0,0 +1,86 @@
+"""
+Benchmark del coste de las métricas por petición: cuánto añaden a cada request el middleware de app.py
+que mide la latencia por ruta y el hook que cuenta los errores, y cuánto cuesta una observación suelta en un histograma
+(observe, y record, el append sin comprobaciones que usa el middleware).
+
+El middleware se mide alrededor de una app WSGI mínima que sólo anota el endpoint resuelto (como hace
+Flask al llamar a los url_value_preprocessors), restando lo que tarda esa app sin middleware: así se mide
+sólo el trabajo de las métricas (reloj, búsqueda de la serie, registro de la observación), no el de Flask.
+El objetivo es que el total por petición quede por debajo de 1 µs. Se imprime también el suelo que ninguna
+implementación puede evitar (dos lecturas del reloj y fijar el endpoint en la ContextVar): en una máquina
+lenta o compartida ese suelo ya se acerca al presupuesto, y el veredicto se da tal cual, sin ajustarlo.
+
+Uso:
+    python bench_metrics.py [--iterations 200000]
+"""
+import argparse
+import os
+import timeit
+from contextvars import ContextVar
+from time import perf_counter
+from types import SimpleNamespace
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import app as api  # noqa: E402  (app.py abre el modelo con rutas relativas)
+from metrics import WSGIMetricsMiddleware  # noqa: E402
+
+BUDGET_NS = 1000
+
+
+def per_call_ns(fn, iterations):
+    # Mejor de 5 repeticiones, para quitar el ruido del planificador
+    return min(timeit.repeat(fn, number=iterations, repeat=5)) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    body = [b'{}']
+    remember_endpoint = api.app.wsgi_app._remember_endpoint
+
+    def bare_app(environ, start_response):
+        remember_endpoint('predict', {})
+        start_response('200 OK', [])
+        return body
+
+    instrumented = WSGIMetricsMiddleware(SimpleNamespace(wsgi_app=bare_app, url_value_preprocessor=lambda f: f),
+                                         api.core.request_latency)
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/v1/predict'}
+
+    def start_response(status, headers, exc_info=None):
+        return None
+
+    probe = ContextVar('probe', default=None)
+
+    def floor():
+        probe.set(None)
+        return perf_counter() - perf_counter()
+
+    series = api.core.request_latency.labels('predict', 'GET')
+    ok = api.app.response_class('{}', status=200)
+    results = {
+        'histogram observe': per_call_ns(lambda: series.observe(0.0003), args.iterations),
+        'histogram record': per_call_ns(lambda: series.record(0.0003), args.iterations),
+        'labels + observe': per_call_ns(lambda: api.core.request_latency.labels('predict', 'GET').observe(0.0003),
+                                        args.iterations),
+        'bare app': per_call_ns(lambda: bare_app(environ, start_response), args.iterations),
+        'app + middleware': per_call_ns(lambda: instrumented(environ, start_response), args.iterations),
+        'count_errors (2xx)': per_call_ns(lambda: api.core.count_errors(ok), args.iterations),
+        'floor (clock x2)': per_call_ns(floor, args.iterations) - per_call_ns(lambda: None, args.iterations),
+    }
+
+    print(f"{'operation':<20} {'ns/call':>8}")
+    for name, ns in results.items():
+        print(f"{name:<20} {ns:>8.0f}")
+
+    overhead = results['app + middleware'] - results['bare app'] + results['count_errors (2xx)']
+    verdict = 'OK' if overhead < BUDGET_NS else 'OVER BUDGET'
+    print(f"\nmetrics overhead per request: {overhead:.0f} ns (budget {BUDGET_NS} ns) -> {verdict}")
+    print(f"unavoidable floor on this machine: {results['floor (clock x2)']:.0f} ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark de arranque de la API: mide cuánto tarda un proceso nuevo en importar app.py y cuánta memoria ocupa.
+
+Compara dos escenarios, cada uno en un intérprete limpio:
+- lazy:  `import app` tal cual, que sólo carga Flask, NumPy y el modelo.
+- eager: importar antes pandas y scikit-learn, como hacía app.py al importar todo lo del entrenamiento a nivel de módulo.
+
+Uso:
+    python bench_startup.py [--runs 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+SCENARIOS = {
+    'lazy': "import app",
+    'eager': ("import pandas, sklearn.model_selection, sklearn.linear_model, sklearn.metrics\n"
+              "import app"),
+}
+
+# Cada proceso imprime su tiempo de import (s) y su pico de memoria residente (KB en Linux)
+PROBE = """
+import resource, time
+t0 = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - t0
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def run_scenario(code, runs):
+    here = os.path.dirname(os.path.abspath(__file__))
+    times, rss = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(code=code)], cwd=here,
+                             capture_output=True, text=True, check=True).stdout.split()
+        times.append(float(out[-2]))
+        rss.append(int(out[-1]))
+    return statistics.median(times), statistics.median(rss)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    results = {name: run_scenario(code, args.runs) for name, code in SCENARIOS.items()}
+    print(f"{'scenario':<8} {'import (ms)':>12} {'max RSS (MB)':>13}")
+    for name, (elapsed, rss) in results.items():
+        print(f"{name:<8} {elapsed * 1000:>12.1f} {rss / 1024:>13.1f}")
+
+    (lazy_t, lazy_rss), (eager_t, eager_rss) = results['lazy'], results['eager']
+    print(f"\nlazy imports: {eager_t / lazy_t:.1f}x faster start, {(eager_rss - lazy_rss) / 1024:.1f} MB less RSS per worker")
+
+
+if __name__ == '__main__':
+    main()
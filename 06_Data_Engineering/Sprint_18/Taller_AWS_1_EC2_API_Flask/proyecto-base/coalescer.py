@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from process_local import ProcessLocal
+
+
+class PredictionCoalescer:
+    """
+    Agrupa peticiones concurrentes de una sola fila en una única llamada vectorizada a predict.
+
+    Cada llamada a predict(row) deja la fila en una cola y espera su resultado. Un hilo de fondo toma
+    la primera fila pendiente y sigue recogiendo hasta juntar `max_batch` filas o hasta que pasan
+    `max_wait_ms` milisegundos desde que llegó la primera; entonces predice el lote entero de una vez
+    y entrega a cada llamante su valor (o la excepción, si el lote falla). Sólo espera mientras haya
+    otras peticiones en curso que aún no están en el lote: una petición sola se predice al momento.
+
+    `get_model` se invoca en cada lote, así que un modelo publicado en el registro se usa desde el siguiente lote.
+    El hilo se arranca en la primera petición de cada proceso, de modo que funciona igual tras un fork.
+    Si se pasa `on_inference`, se llama con los segundos que tarda el predict de cada lote.
+    """
+
+    def __init__(self, get_model, max_batch=64, max_wait_ms=2.0, on_inference=None):
+        self.get_model = get_model
+        self.on_inference = on_inference
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._worker = ProcessLocal(self._start_worker)
+        self._submitted_lock = threading.Lock()
+        self._submitted = 0  # Filas encoladas; menos _dispatched, las que aún no han entrado en un lote
+        self._dispatched = 0
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        with self._stats_lock:
+            self._batches = 0
+            self._rows = 0
+            self._max_batch_seen = 0
+            self._batch_sizes = {}        # tamaño de lote -> número de lotes
+            self._queue_delay_total = 0.0
+            self._queue_delay_max = 0.0
+
+    def _start_worker(self):
+        self._queue = queue.SimpleQueue()
+        self._submitted = self._dispatched = 0
+        threading.Thread(target=self._run, daemon=True, name='prediction-coalescer').start()
+
+    def predict(self, row):
+        """Predice una fila (tv, radio, newspaper) dentro del próximo lote y devuelve su predicción."""
+        self._worker.get()
+        future = Future()
+        with self._submitted_lock:
+            self._submitted += 1
+        self._queue.put((row, time.perf_counter(), future))
+        return future.result()
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = first[1] + self.max_wait
+        while len(batch) < self.max_batch:
+            if self._submitted - self._dispatched <= len(batch):
+                break  # No hay otra petición en camino: esperar sólo añadiría latencia
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            rows = np.array([row for row, _, _ in batch], dtype=np.float64)
+            self._dispatched += len(batch)  # Antes de entregar resultados: el llamante puede volver a encolar enseguida
+            try:
+                predictions = self.get_model().predict(rows)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+            else:
+                if self.on_inference is not None:
+                    self.on_inference(time.perf_counter() - started)
+                for (_, _, future), prediction in zip(batch, predictions):
+                    future.set_result(prediction)
+            self._record(batch, started)
+
+    def _record(self, batch, started):
+        size = len(batch)
+        delays = [started - enqueued for _, enqueued, _ in batch]
+        with self._stats_lock:
+            self._batches += 1
+            self._rows += size
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._queue_delay_total += sum(delays)
+            self._queue_delay_max = max(self._queue_delay_max, max(delays))
+
+    def stats(self):
+        """Métricas de los lotes: número, tamaño medio y máximo, histograma de tamaños y retardo en cola (ms)."""
+        with self._stats_lock:
+            return {
+                'max_batch': self.max_batch,
+                'max_wait_ms': self.max_wait * 1000,
+                'batches': self._batches,
+                'rows': self._rows,
+                'mean_batch_size': self._rows / self._batches if self._batches else 0.0,
+                'max_batch_size': self._max_batch_seen,
+                'batch_size_counts': dict(sorted(self._batch_sizes.items())),
+                'mean_queue_delay_ms': 1000 * self._queue_delay_total / self._rows if self._rows else 0.0,
+                'max_queue_delay_ms': 1000 * self._queue_delay_max,
+            }
@@ -0,0 +1,53 @@
+"""
+Configuración de gunicorn para servir la API en producción (por ejemplo en la instancia EC2):
+
+    gunicorn -c gunicorn.conf.py
+
+Con preload_app el proceso master importa app.py (Flask, NumPy y el modelo) una sola vez antes de
+crear los workers; al hacer fork, los workers comparten esas páginas de memoria copy-on-write en lugar
+de cargar cada uno su copia. Los hilos del agrupador de predicciones y de los jobs se crean dentro de
+cada worker la primera vez que se usan, así que no se pierden en el fork.
+
+Tras un retrain, el worker que lo ejecuta publica el modelo nuevo como versión del almacén (models/) y
+el resto ve el cambio del puntero models/CURRENT y lo recarga en su registro en memoria (ver
+model_registry.py y model_store.py). El estado de cada retrain se guarda en jobs/<id>.json, así que
+cualquier worker responde a /api/v1/retrain/<job_id> (ver jobs.py). Igual con las métricas: cada worker vuelca
+las suyas a .metrics/ (METRICS_DIR) y /metrics devuelve la suma de todos, responda el que responda.
+
+Variables de entorno: PORT (5000), WEB_CONCURRENCY (workers, 2 x CPUs + 1) y GUNICORN_THREADS (hilos por worker, 4).
+"""
+import gc
+import multiprocessing
+import os
+import shutil
+
+wsgi_app = 'app:app'
+chdir = os.path.dirname(os.path.abspath(__file__))  # app.py usa rutas relativas (ad_model.json, data/...)
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+preload_app = True
+
+# Workers por proceso para aprovechar todos los cores, e hilos dentro de cada uno para que las
+# peticiones concurrentes de una fila puedan agruparse en el mismo lote de predict
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+timeout = 30
+keepalive = 5
+
+
+# Las métricas de cada worker se vuelcan a METRICS_DIR y /metrics las suma todas (ver metrics.MetricsRegistry)
+os.environ.setdefault('METRICS_DIR', os.path.join(chdir, '.metrics'))
+
+
+def on_starting(server):
+    # Los totales empiezan de cero con cada arranque: fuera los ficheros de métricas de la ejecución anterior
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+
+def when_ready(server):
+    # Con la app ya precargada, movemos todos sus objetos a la generación permanente del GC: así las
+    # recolecciones de los workers no los tocan y sus páginas siguen compartidas tras el fork
+    gc.collect()
+    gc.freeze()
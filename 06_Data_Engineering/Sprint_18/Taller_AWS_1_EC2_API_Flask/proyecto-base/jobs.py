@@ -0,0 +1,145 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_io import atomic_write
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos, sólo dentro del proceso
+    fcntl = None
+
+
+_JOB_ID = re.compile(r'[0-9a-f]{32}')  # uuid4().hex
+
+
+class JobAlreadyRunning(Exception):
+    """Ya hay un job en cola o en ejecución; lleva su id para que el cliente pueda consultarlo."""
+
+    def __init__(self, job_id):
+        super().__init__(job_id)
+        self.job_id = job_id
+
+
+class JobRunner:
+    """
+    Ejecuta trabajos largos (el reentrenamiento) en un hilo de fondo, de uno en uno.
+
+    submit() devuelve al momento un id de job; status() devuelve su estado ('queued', 'running',
+    'finished' o 'failed'), con el resultado de la función cuando termina o el error si falla.
+    Mientras un job está en cola o en ejecución, un segundo submit se rechaza con JobAlreadyRunning.
+    Se guarda el estado de los últimos `history` jobs.
+
+    Con `lock_path`, el rechazo también se aplica entre procesos (varios workers de gunicorn): mientras
+    dura el job se mantiene un flock sobre ese fichero, que guarda el id del job activo.
+
+    Con `state_dir`, el estado de cada job se guarda además en `state_dir/<id>.json` (escrito en un fichero
+    temporal y renombrado, así que nunca se lee a medias) y status() lo lee de ahí: cualquier worker puede
+    responder por un job lanzado en otro.
+    """
+
+    def __init__(self, history=20, lock_path=None, state_dir=None):
+        self.history = history
+        self.lock_path = lock_path
+        self.state_dir = state_dir
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+        self._lock_fd = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-runner')
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._active = None
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._active is not None:
+                raise JobAlreadyRunning(self._active)
+            job_id = uuid.uuid4().hex
+            self._acquire_process_lock(job_id)
+            self._jobs[job_id] = {'job_id': job_id, 'status': 'queued', 'submitted_at': time.time()}
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+            self._active = job_id
+            self._save(self._jobs[job_id])
+            self._prune()
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status='running', started_at=time.time())
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+        else:
+            self._update(job_id, status='finished', result=result, finished_at=time.time())
+        finally:
+            with self._lock:
+                self._release_process_lock()
+                self._active = None
+
+    def _acquire_process_lock(self, job_id):
+        if self.lock_path is None or fcntl is None:
+            return
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            active = os.read(fd, 64).decode() or None
+            os.close(fd)
+            raise JobAlreadyRunning(active)
+        os.ftruncate(fd, 0)
+        os.write(fd, job_id.encode())
+        self._lock_fd = fd
+
+    def _release_process_lock(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+                self._save(self._jobs[job_id])
+
+    def _path(self, job_id):
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def _save(self, job):
+        if self.state_dir is None:
+            return
+        # El resultado puede traer escalares o arrays de NumPy (métricas del reentrenamiento)
+        atomic_write(self._path(job['job_id']),
+                     json.dumps(job, default=lambda value: value.tolist() if hasattr(value, 'tolist') else str(value)))
+
+    def _prune(self):
+        # Sólo se guardan los últimos `history` jobs, también en disco
+        if self.state_dir is None:
+            return
+        saved = [entry for entry in os.scandir(self.state_dir) if entry.name.endswith('.json')]
+        saved.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in saved[:-self.history]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:  # Lo ha borrado otro worker
+                pass
+
+    def status(self, job_id):
+        if self.state_dir is not None:
+            if not _JOB_ID.fullmatch(job_id):  # El id llega en la URL: nada de rutas fuera de state_dir
+                return None
+            try:
+                with open(self._path(job_id)) as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
@@ -0,0 +1,324 @@
+"""
+Prueba de carga de la API: arranca la app en local (o ataca una URL ya levantada), lanza mezclas de
+peticiones con concurrencia creciente y mide latencias p50/p95/p99 y throughput en cada nivel.
+
+Escenarios (--scenarios):
+- single:  sólo GET /api/v1/predict, con filas tomadas de un conjunto de --distinct filas distintas.
+- batch:   sólo POST /api/v1/predict/batch con --batch-size filas por petición.
+- mixed:   90 % single, 10 % batch.
+- retrain: como single, pero con un GET /api/v1/retrain/ cada --retrain-every segundos, para ver cómo
+           afecta a las predicciones un reentrenamiento en curso.
+
+La app se arranca sobre una copia temporal del proyecto, así que los reentrenamientos no tocan el modelo
+del repositorio. Con --server gunicorn se usa gunicorn.conf.py (varios workers); con --server flask, el
+servidor de desarrollo con hilos. Los resultados se guardan en loadtest_results/<fecha>_<commit>.json
+para comparar versiones de app.py:
+
+    python loadtest.py --server gunicorn --concurrency 1,4,16,64 --duration 10
+    python loadtest.py --compare loadtest_results/A.json loadtest_results/B.json
+
+El cliente son hilos de Python en la misma máquina: para medir el techo real de una instancia EC2,
+lanzarlo desde otra máquina con --url http://<ip>:<puerto>.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, 'loadtest_results')
+
+SCENARIOS = {
+    'single': {'mix': {'single': 1.0}},
+    'batch': {'mix': {'batch': 1.0}},
+    'mixed': {'mix': {'single': 0.9, 'batch': 0.1}},
+    'retrain': {'mix': {'single': 1.0}, 'retrain': True},
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(server, port):
+    """Copia el proyecto a un directorio temporal y arranca allí la app. Devuelve (proceso, directorio)."""
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    shutil.copytree(HERE, workdir, dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns('loadtest_results', '__pycache__', 'retrain.lock', 'models'))
+    env = dict(os.environ, PORT=str(port))
+    if server == 'gunicorn':
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}']
+    else:
+        cmd = [sys.executable, '-c', f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    process = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process, workdir
+
+
+def wait_until_up(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, _ = Client(base_url).request('GET', '/')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"The API did not start at {base_url} within {timeout} s")
+
+
+class Client:
+    """Conexión HTTP keep-alive de un hilo; se reabre sola si el servidor la cierra."""
+
+    def __init__(self, base_url, timeout=30):
+        url = urlsplit(base_url)
+        self.conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        try:
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            raise
+        if response.will_close:
+            self.conn.close()
+        return response.status, data
+
+
+class RequestFactory:
+    """Genera las peticiones de cada tipo con filas aleatorias reproducibles (semilla por hilo)."""
+
+    def __init__(self, distinct, batch_size, seed):
+        pool = np.random.default_rng(seed).uniform([0, 0, 0], [300, 50, 120], size=(distinct, 3)).round(1)
+        self.queries = [f'/api/v1/predict?tv={tv}&radio={radio}&newspaper={newspaper}' for tv, radio, newspaper in pool]
+        self.batch_size = batch_size
+        self.pool = pool
+
+    def single(self, rng):
+        return 'GET', rng.choice(self.queries), None, None
+
+    def batch(self, rng):
+        rows = self.pool[[rng.randrange(len(self.pool)) for _ in range(self.batch_size)]]
+        return 'POST', '/api/v1/predict/batch', json.dumps(rows.tolist()), {'Content-Type': 'application/json'}
+
+
+def run_level(base_url, factory, scenario, concurrency, duration, retrain_every):
+    """Lanza `concurrency` hilos durante `duration` segundos y devuelve las latencias y errores de cada tipo."""
+    kinds, weights = zip(*SCENARIOS[scenario]['mix'].items())
+    records = {kind: [] for kind in kinds}
+    errors = {kind: 0 for kind in kinds}
+    retrains = {'accepted': 0, 'already_running': 0, 'failed': 0}
+    lock = threading.Lock()
+    start = threading.Barrier(concurrency + 1)
+    stop = threading.Event()
+
+    def worker(i):
+        rng = random.Random(i)
+        client = Client(base_url)
+        latencies = {kind: [] for kind in kinds}
+        failed = {kind: 0 for kind in kinds}
+        start.wait()
+        while not stop.is_set():
+            kind = rng.choices(kinds, weights)[0]
+            method, path, body, headers = getattr(factory, kind)(rng)
+            t0 = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, body, headers)
+            except (http.client.HTTPException, OSError):
+                status = None
+            elapsed = time.perf_counter() - t0
+            if status == 200:
+                latencies[kind].append(elapsed)
+            else:
+                failed[kind] += 1
+        with lock:
+            for kind in kinds:
+                records[kind].extend(latencies[kind])
+                errors[kind] += failed[kind]
+
+    def retrainer():
+        client = Client(base_url)
+        while not stop.wait(retrain_every):
+            try:
+                status, _ = client.request('GET', '/api/v1/retrain/')
+            except (http.client.HTTPException, OSError):
+                status = None
+            # 409: el reentrenamiento anterior aún no ha terminado
+            retrains['accepted' if status == 202 else 'already_running' if status == 409 else 'failed'] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    if SCENARIOS[scenario].get('retrain'):
+        threads.append(threading.Thread(target=retrainer))
+    for thread in threads:
+        thread.start()
+    start.wait()
+    t_start = time.perf_counter()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - t_start
+
+    level = {'concurrency': concurrency, 'duration_s': elapsed, 'kinds': {}}
+    for kind in kinds:
+        latencies = np.array(records[kind]) * 1000
+        stats = {'requests': int(latencies.size), 'errors': errors[kind], 'rps': latencies.size / elapsed}
+        if latencies.size:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats.update(p50_ms=p50, p95_ms=p95, p99_ms=p99, mean_ms=latencies.mean(), max_ms=latencies.max())
+        if kind == 'batch':
+            stats['rows_per_s'] = stats['rps'] * factory.batch_size
+        level['kinds'][kind] = stats
+    level['rps'] = sum(stats['rps'] for stats in level['kinds'].values())
+    if SCENARIOS[scenario].get('retrain'):
+        level['retrains'] = retrains
+    return level
+
+
+def print_level(scenario, level):
+    for kind, stats in level['kinds'].items():
+        print(f"{scenario:<8} {level['concurrency']:>5} {kind:<7} {stats['rps']:>9.1f} "
+              f"{stats.get('p50_ms', float('nan')):>8.2f} {stats.get('p95_ms', float('nan')):>8.2f} "
+              f"{stats.get('p99_ms', float('nan')):>8.2f} {stats['errors']:>7}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args):
+    process = workdir = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        process, workdir = start_server(args.server, port)
+        base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_until_up(base_url)
+        factory = RequestFactory(args.distinct, args.batch_size, seed=0)
+        results = {}
+        print(f"{'scenario':<8} {'conc':>5} {'kind':<7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for scenario in args.scenarios:
+            run_level(base_url, factory, scenario, 1, args.warmup, args.retrain_every)  # Calentamiento, no se guarda
+            results[scenario] = []
+            for concurrency in args.concurrency:
+                level = run_level(base_url, factory, scenario, concurrency, args.duration, args.retrain_every)
+                print_level(scenario, level)
+                results[scenario].append(level)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    for scenario, levels in results.items():
+        peak = max(levels, key=lambda level: level['rps'])
+        print(f"{scenario}: peak {peak['rps']:.1f} req/s at concurrency {peak['concurrency']}")
+
+    revision = git_revision()
+    report = {
+        'meta': {'revision': revision, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'url': args.url,
+                 'server': None if args.url else args.server, 'duration_s': args.duration,
+                 'batch_size': args.batch_size, 'distinct': args.distinct, 'retrain_every_s': args.retrain_every,
+                 'python': sys.version.split()[0], 'cpus': os.cpu_count()},
+        'results': results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{revision}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults saved to {path}")
+    if args.plot:
+        plot(report, args.plot)
+
+
+def plot(report, path):
+    import matplotlib  # Sólo hace falta para --plot
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, (ax_rps, ax_p99) = plt.subplots(1, 2, figsize=(12, 4.5))
+    for scenario, levels in report['results'].items():
+        concurrency = [level['concurrency'] for level in levels]
+        ax_rps.plot(concurrency, [level['rps'] for level in levels], marker='o', label=scenario)
+        for kind in levels[0]['kinds']:
+            ax_p99.plot(concurrency, [level['kinds'][kind].get('p99_ms') for level in levels],
+                        marker='o', label=f'{scenario} / {kind}')
+    for ax, ylabel in ((ax_rps, 'req/s'), (ax_p99, 'p99 (ms)')):
+        ax.set_xscale('log', base=2)
+        ax.set_xlabel('concurrency')
+        ax.set_ylabel(ylabel)
+        ax.legend()
+    fig.suptitle(f"revision {report['meta']['revision']} ({report['meta']['server'] or report['meta']['url']})")
+    fig.tight_layout()
+    fig.savefig(path)
+    print(f"plot saved to {path}")
+
+
+def compare(path_a, path_b):
+    with open(path_a) as f:
+        a = json.load(f)
+    with open(path_b) as f:
+        b = json.load(f)
+    print(f"A = {a['meta']['revision']} ({a['meta']['timestamp']})   B = {b['meta']['revision']} ({b['meta']['timestamp']})")
+    print(f"{'scenario':<8} {'conc':>5} {'req/s A':>9} {'req/s B':>9} {'delta':>7} {'p99 A':>8} {'p99 B':>8}")
+    for scenario in a['results'].keys() & b['results'].keys():
+        levels_b = {level['concurrency']: level for level in b['results'][scenario]}
+        for level_a in a['results'][scenario]:
+            level_b = levels_b.get(level_a['concurrency'])
+            if level_b is None:
+                continue
+            p99 = [max((stats.get('p99_ms', float('nan')) for stats in level['kinds'].values()), default=float('nan'))
+                   for level in (level_a, level_b)]
+            delta = (level_b['rps'] / level_a['rps'] - 1) * 100 if level_a['rps'] else float('nan')
+            print(f"{scenario:<8} {level_a['concurrency']:>5} {level_a['rps']:>9.1f} {level_b['rps']:>9.1f} "
+                  f"{delta:>+6.1f}% {p99[0]:>8.2f} {p99[1]:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'gunicorn'], default='gunicorn')
+    parser.add_argument('--url', help="API ya levantada; si se indica no se arranca ningún servidor")
+    parser.add_argument('--scenarios', type=lambda s: s.split(','), default=['single', 'batch', 'mixed', 'retrain'])
+    parser.add_argument('--concurrency', type=lambda s: [int(c) for c in s.split(',')], default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--duration', type=float, default=10, help="segundos por nivel de concurrencia")
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--distinct', type=int, default=1000, help="filas distintas de las peticiones single (acierto de caché)")
+    parser.add_argument('--retrain-every', type=float, default=2.0)
+    parser.add_argument('--output', help="fichero JSON de resultados (por defecto en loadtest_results/)")
+    parser.add_argument('--plot', help="guarda las curvas de throughput y p99 en esta imagen")
+    parser.add_argument('--compare', nargs=2, metavar=('A', 'B'), help="compara dos ficheros de resultados")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    unknown = set(args.scenarios) - SCENARIOS.keys()
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
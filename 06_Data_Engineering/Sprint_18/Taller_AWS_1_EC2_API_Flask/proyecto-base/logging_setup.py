@@ -0,0 +1,117 @@
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+from process_local import ProcessLocal
+
+# Fracción de peticiones de cada endpoint que se registran con detalle (LOG_SAMPLE_RATES="predict=0.01,retrain=1").
+# Los endpoints que no aparecen se registran siempre.
+DEFAULT_SAMPLE_RATES = {'predict': 0.01, 'predict_batch': 0.1}
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos pasados en extra={'fields': {...}}."""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:  # Ya convertido a texto en NonBlockingQueueHandler.prepare
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Deja cada registro en una cola acotada y vuelve al momento; un hilo (QueueListener) lo escribe después.
+    Si la cola está llena el registro se descarta y se cuenta en `dropped`, en lugar de bloquear la petición.
+    El hilo se arranca en el primer registro de cada proceso, así que funciona igual tras el fork de gunicorn.
+    """
+
+    def __init__(self, target, maxsize=10000):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.target = target
+        self.dropped = 0
+        self._listener = ProcessLocal(self._start_listener)
+
+    def _start_listener(self):
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+        listener.start()
+        return listener
+
+    def prepare(self, record):
+        # El prepare de QueueHandler mete el formato por defecto (traceback incluido) en msg; aquí se deja
+        # msg/args como están, para el JsonFormatter del listener, y el traceback pasa a texto en exc_text
+        # (la traza con sus frames no debe viajar por la cola ni sobrevivir a la petición)
+        record = copy.copy(record)
+        if record.exc_info:
+            formatter = self.target.formatter or logging.Formatter()
+            record.exc_text = record.exc_text or formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._listener.get()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        listener = self._listener.peek()
+        if listener is not None:
+            listener.stop()
+
+
+class Sampler:
+    """Decide, por endpoint, si una petición se registra con detalle."""
+
+    def __init__(self, rates):
+        self.rates = rates
+
+    def sample(self, endpoint):
+        rate = self.rates.get(endpoint, 1.0)
+        return rate >= 1.0 or (rate > 0 and random.random() < rate)
+
+
+def parse_sample_rates(spec):
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        endpoint, _, rate = item.partition('=')
+        rates[endpoint.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(name='advertising_api', level=None, sample_rates=None, stream=None):
+    """
+    Prepara el logger de la API y devuelve (logger, sampler).
+
+    El nivel sale de `level` o de la variable LOG_LEVEL (INFO por defecto) y las tasas de muestreo de
+    `sample_rates` o de LOG_SAMPLE_RATES. Los registros se formatean como JSON y se escriben en `stream`
+    (stdout por defecto) desde el hilo del QueueListener, nunca desde el hilo de la petición.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(JsonFormatter())
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(NonBlockingQueueHandler(target))
+
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES'))
+    return logger, Sampler(sample_rates)
@@ -0,0 +1,396 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from time import perf_counter
+
+import numpy as np
+
+from atomic_io import atomic_write
+from process_local import ProcessLocal
+
+# Límites (en segundos) de los buckets de los histogramas de tiempos: de 50 µs a 10 s
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Observaciones pendientes de un histograma a partir de las cuales se vuelcan a los buckets sin esperar al scrape
+FOLD_AT = 65536
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+    aggregate = 'sum'  # Cómo se juntan las series de varios procesos (ver MetricsRegistry)
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}  # valores de etiqueta como str -> serie (lo que se exporta)
+        self._lookup = {}    # valores tal como llegan (p. ej. el status como int) -> serie, para no convertirlos cada vez
+
+    def labels(self, *values):
+        """Devuelve la serie de estos valores de etiqueta; tras la primera vez es una sola búsqueda en un diccionario."""
+        child = self._lookup.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(tuple(str(v) for v in values), self._new_child())
+                self._lookup[values] = child
+        return child
+
+    def collect(self):
+        """Valor de cada serie de este proceso: {valores de etiqueta: muestra}."""
+        return {values: self._sample(child) for values, child in list(self._children.items())}
+
+    def reset(self):
+        # Tras un fork: las series siguen siendo las mismas (quien guarda child.observe sigue valiendo), a cero
+        self._lock = threading.Lock()
+        for child in list(self._children.values()):
+            child.reset()
+
+    def render(self, samples=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, sample in sorted((self.collect() if samples is None else samples).items()):
+            lines.extend(self._render_sample(values, sample))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Contador que sólo crece (errores, reentrenamientos...)."""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, *labelvalues, amount=1.0):
+        self.labels(*labelvalues).inc(amount)
+
+    @staticmethod
+    def _sample(child):
+        return child.value
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def _render_sample(self, values, value):
+        yield f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}'
+
+
+class _HistogramChild:
+    """
+    observe() sólo añade el valor a una deque (append es atómico y no necesita lock). Los valores
+    pendientes se reparten en los buckets con NumPy al exportar, o cuando se acumulan FOLD_AT.
+    `record` es ese append sin la comprobación de FOLD_AT, para el camino más caliente: lo que deja se
+    reparte al exportar y cada flush_interval segundos desde el hilo de MetricsRegistry.
+    """
+
+    __slots__ = ('_lock', '_bounds', '_pending', 'record', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self._bounds = np.asarray(bounds, dtype=np.float64)
+        self._pending = deque()
+        self.record = self._pending.append
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._pending.clear()  # La misma deque: quien guarda `record` sigue escribiendo en ella
+        self.counts = np.zeros(len(self._bounds) + 1, dtype=np.int64)  # El último es el bucket +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        pending = self._pending
+        pending.append(value)
+        if len(pending) >= FOLD_AT:
+            self.fold()
+
+    def fold(self):
+        with self._lock:
+            pending = self._pending
+            # popleft de n elementos: lo que se añada mientras tanto queda para el siguiente volcado
+            values = np.fromiter((pending.popleft() for _ in range(len(pending))), dtype=np.float64)
+            if values.size:
+                # searchsorted 'left' pone cada valor en el primer bucket con límite >= valor (le="...")
+                self.counts += np.bincount(np.searchsorted(self._bounds, values, side='left'),
+                                           minlength=self.counts.size)
+                self.sum += float(values.sum())
+            return self.counts.tolist(), self.sum
+
+
+class Histogram(_Metric):
+    """
+    Histograma con buckets fijos. Guarda cuántas observaciones caen en cada bucket (no acumulado) y
+    la suma; los valores acumulados que pide el formato de Prometheus se calculan al exportar.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value, *labelvalues):
+        self.labels(*labelvalues).observe(value)
+
+    @staticmethod
+    def _sample(child):
+        return child.fold()
+
+    @staticmethod
+    def merge(a, b):
+        return [x + y for x, y in zip(a[0], b[0])], a[1] + b[1]
+
+    def _render_sample(self, values, sample):
+        counts, total = sample
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, [('le', _format_value(bound))])
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = _format_labels(self.labelnames, values)
+        yield f'{self.name}_sum{labels} {_format_value(total)}'
+        yield f'{self.name}_count{labels} {cumulative}'
+
+
+class CallbackMetric:
+    """
+    Métrica cuyo valor se lee al exportar, llamando a `fn`. `fn` devuelve un número, o un diccionario
+    {valores de etiqueta (tupla): número} si la métrica tiene etiquetas. Sirve para volcar en /metrics
+    estadísticas que ya lleva otro objeto (la caché, el agrupador) sin duplicarlas en el hot path.
+
+    `aggregate` dice cómo se junta con la de los demás procesos: 'sum', 'max' o 'local' (sólo la del proceso
+    que responde, para medias o valores que ya son globales). Por defecto 'sum' en los contadores y 'local' en el resto.
+    """
+
+    def __init__(self, name, documentation, fn, labelnames=(), kind='gauge', aggregate=None):
+        if aggregate not in (None, 'sum', 'max', 'local'):
+            raise ValueError(f"aggregate must be 'sum', 'max' or 'local', got {aggregate!r}")
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self.aggregate = aggregate or ('sum' if kind == 'counter' else 'local')
+
+    def collect(self):
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return {tuple(str(v) for v in labelvalues): value for labelvalues, value in values.items()}
+
+    def merge(self, a, b):
+        return a + b if self.aggregate == 'sum' else max(a, b)
+
+    def reset(self):
+        pass  # El valor lo lleva otro objeto
+
+    def render(self, samples=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for labelvalues, value in sorted((self.collect() if samples is None else samples).items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Conjunto de métricas de un proceso, exportadas en el formato de texto de Prometheus con render().
+
+    Cada proceso lleva sus propias métricas en memoria. Con varios workers de gunicorn detrás de un puerto,
+    cada scrape caería en un worker cualquiera y los contadores podrían ir hacia atrás; con `multiprocess_dir`,
+    un hilo de cada proceso vuelca sus series cada `flush_interval` segundos (y al salir y antes de un fork) a
+    <multiprocess_dir>/<pid>-<token>.json. render() vuelca primero las suyas y devuelve la suma de todos los
+    ficheros: lo que se exporta sale siempre de ficheros que sólo crecen, así que ningún total baja entre dos
+    scrapes aunque los atiendan workers distintos. Los de procesos que ya terminaron se siguen sumando, para que los totales no bajen: el directorio se
+    vacía al arrancar el servidor (ver gunicorn.conf.py). Tras un fork el hijo empieza de cero, porque lo que
+    lleva heredado ya está en el fichero del padre.
+    """
+
+    def __init__(self, prefix='', multiprocess_dir=None, flush_interval=5.0):
+        self.prefix = prefix
+        self._metrics = []
+        self.multiprocess_dir = multiprocess_dir or None
+        self.flush_interval = flush_interval
+        self._file = None
+        if self.multiprocess_dir is not None:
+            os.register_at_fork(before=self.flush)
+            atexit.register(self.flush)
+        # Un hilo por proceso reparte cada flush_interval segundos lo pendiente de los histogramas y vuelca el fichero
+        self._process = ProcessLocal(self._start_process, eager=True)
+
+    def _start_process(self):
+        if self.multiprocess_dir is not None:
+            if self._file is not None:  # Hijo de un fork: lo heredado ya cuenta en el fichero del padre
+                for metric in self._metrics:
+                    metric.reset()
+            self._file = os.path.join(self.multiprocess_dir, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        thread = threading.Thread(target=self._flush_loop, daemon=True, name='metrics-flusher')
+        thread.start()
+        return thread
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Reparte lo pendiente de los histogramas y, con multiprocess_dir, vuelca las series de este proceso (salvo
+        las 'local') a su fichero y las devuelve (sin multiprocess_dir devuelve None).
+        """
+        snapshot = {metric.name: [[list(values), sample] for values, sample in metric.collect().items()]
+                    for metric in self._metrics if metric.aggregate != 'local'}
+        if self._file is None:
+            return None
+        try:
+            os.makedirs(self.multiprocess_dir, exist_ok=True)
+            atomic_write(self._file, json.dumps(snapshot, default=_to_json))
+        except OSError:
+            pass  # Sin disco, /metrics sigue teniendo al menos las de este proceso
+        return snapshot
+
+    def _others(self):
+        # Series volcadas por los demás procesos (las de este se leen de memoria)
+        if self._file is None:
+            return []
+        try:
+            names = os.listdir(self.multiprocess_dir)
+        except FileNotFoundError:
+            return []
+        snapshots = []
+        for name in names:
+            path = os.path.join(self.multiprocess_dir, name)
+            if not name.endswith('.json') or path == self._file:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, fn, labelnames=(), kind='gauge', aggregate=None):
+        return self._add(CallbackMetric(self.prefix + name, documentation, fn, labelnames, kind, aggregate))
+
+    def render(self):
+        own = self.flush()  # None sin multiprocess_dir
+        others = self._others()
+        lines = []
+        for metric in self._metrics:
+            if own is None or metric.aggregate == 'local':
+                samples = metric.collect()
+            else:
+                samples = {tuple(values): sample for values, sample in own.get(metric.name, ())}
+                for snapshot in others:
+                    for values, sample in snapshot.get(metric.name, ()):
+                        values = tuple(values)
+                        samples[values] = metric.merge(samples[values], sample) if values in samples else sample
+            lines.extend(metric.render(samples))
+        return '\n'.join(lines) + '\n'
+
+
+def _to_json(value):
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+# Endpoint de Flask que atiende la petición en curso, lo apunta un url_value_preprocessor (ver WSGIMetricsMiddleware)
+_current_endpoint = ContextVar('metrics_endpoint', default=None)
+
+
+def current_endpoint():
+    """Endpoint de la petición en curso ('predict', 'retrain_status'...), o 'unmatched' si ninguna ruta coincide."""
+    return _current_endpoint.get() or 'unmatched'
+
+
+class WSGIMetricsMiddleware:
+    """
+    Middleware WSGI que mide la latencia de cada petición por endpoint y método. Se monta con
+    `app.wsgi_app = WSGIMetricsMiddleware(app, histograma)`.
+
+    Va por fuera de Flask para no usar los proxies de contexto (request, g), que son lo más caro de
+    leer en cada petición. El endpoint lo recibe como argumento un url_value_preprocessor, que lo deja
+    en una ContextVar; Flask lo llama en el mismo hilo y contexto que este middleware.
+    La latencia cubre hasta que la app devuelve la respuesta, sin contar el envío del cuerpo.
+    """
+
+    def __init__(self, app, latency):
+        self.wsgi_app = app.wsgi_app
+        self.latency = latency
+        self._observe = {}  # método -> {endpoint -> observe de su serie}: dos búsquedas sin crear una tupla por petición
+        app.url_value_preprocessor(self._remember_endpoint)
+
+    @staticmethod
+    def _remember_endpoint(endpoint, values):
+        _current_endpoint.set(endpoint)
+
+    def _new_series(self, method, endpoint):
+        observe = self.latency.labels(endpoint, method).record  # Sólo el append: el reparto lo hace el hilo de las métricas
+        self._observe.setdefault(method, {})[endpoint] = observe
+        return observe
+
+    def __call__(self, environ, start_response):
+        _current_endpoint.set(None)  # Los hilos del servidor se reutilizan entre peticiones
+        started = perf_counter()
+        result = self.wsgi_app(environ, start_response)
+        elapsed = perf_counter() - started
+
+        method = environ['REQUEST_METHOD']
+        endpoint = _current_endpoint.get() or 'unmatched'
+        by_endpoint = self._observe.get(method)
+        observe = by_endpoint.get(endpoint) if by_endpoint is not None else None
+        if observe is None:
+            observe = self._new_series(method, endpoint)
+        observe(elapsed)
+        return result
@@ -0,0 +1,183 @@
+import os
+import pickle
+import threading
+import time
+
+from artifact import export_linear_model, load_linear_model
+from atomic_io import atomic_write
+
+
+class ModelRegistry:
+    """
+    Registro del modelo servido por la API: lo carga una sola vez por proceso y lo sirve desde memoria.
+
+    El modelo vigente se guarda en una única tupla (modelo, versión, mtime o versión del almacén) que se
+    sustituye de golpe, así que una petición en curso ve siempre el modelo anterior completo o el nuevo
+    completo, y leerlo nunca espera a un lock.
+
+    Si otro proceso reescribe el fichero (por ejemplo un retrain en otro worker), se detecta por su mtime,
+    comprobado como mucho cada `check_interval` segundos, y se recarga en un hilo aparte: mientras tanto
+    las peticiones siguen usando el modelo anterior.
+
+    Si `path` termina en .json se trata como artefacto lineal (ver artifact.py) y se carga sólo con NumPy;
+    en otro caso se usa pickle. Si se pasa `on_load`, se llama con los segundos que tarda cada carga del fichero.
+
+    Con `store` (un ModelStore, ver model_store.py) en lugar de `path`, lo que se vigila es el puntero CURRENT
+    del almacén de versiones: publicar, cambiar de versión o hacer rollback en cualquier proceso es reescribir
+    ese puntero, y cada proceso carga la versión a la que apunta. Con `source` (el ad_model.json o .pkl del que
+    sale la primera versión) se vigila además ese fichero: si otro lo reescribe (un git pull, la salida de
+    model.py), se importa como versión nueva del almacén y se pone en servicio en todos los workers.
+    """
+
+    def __init__(self, path=None, check_interval=1.0, on_load=None, store=None, source=None):
+        if (path is None) == (store is None):
+            raise ValueError("Pass either path or store")
+        if source is not None and store is None:
+            raise ValueError("source needs a store")
+        self.path = path
+        self.store = store
+        self.source = source
+        self._source_stat = self._stat_source()
+        self.check_interval = check_interval
+        self.on_load = on_load
+        self._reload_lock = threading.Lock()  # Sólo serializa las recargas, nunca las lecturas
+        self._swap_lock = threading.Lock()    # Numera las versiones sin carreras entre recarga y publish
+        self._last_check = time.monotonic()
+        stamp = self._stamp()
+        self._current = (self._load(stamp), 1, stamp)
+
+    @property
+    def is_artifact(self):
+        return self.path is not None and self.path.endswith('.json')
+
+    @property
+    def stored_version(self):
+        """Versión del almacén en servicio en este proceso (None si se sirve directamente un fichero)."""
+        return self._current[2] if self.store is not None else None
+
+    def _stamp(self):
+        # Identifica lo publicado: la versión a la que apunta CURRENT o, sin almacén, el mtime del fichero
+        if self.store is not None:
+            return self.store.current()
+        return os.stat(self.path).st_mtime_ns
+
+    def _load(self, stamp):
+        started = time.perf_counter()
+        if self.store is not None:
+            model = self.store.load(stamp)
+        elif self.is_artifact:
+            model = load_linear_model(self.path)
+        else:
+            with open(self.path, 'rb') as f:
+                model = pickle.load(f)
+        if self.on_load is not None:
+            self.on_load(time.perf_counter() - started)
+        return model
+
+    def _dump(self, model):
+        if self.is_artifact:
+            export_linear_model(model, self.path)
+            return
+        # Quien lo lea a la vez ve el pickle anterior o el nuevo, nunca uno a medias
+        atomic_write(self.path, pickle.dumps(model))
+
+    @property
+    def version(self):
+        return self._current[1]
+
+    def _maybe_check(self):
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self._check_source()
+
+    def get(self):
+        """Devuelve el modelo vigente, lanzando una recarga en segundo plano si el fichero ha cambiado."""
+        self._maybe_check()
+        return self._current[0]
+
+    def current(self):
+        """
+        Devuelve la tupla (modelo, versión) vigente, leída de forma atómica. Como get(), comprueba si hay un
+        modelo nuevo: úsese también cuando sólo hace falta la versión (p. ej. para consultar la caché).
+        """
+        self._maybe_check()
+        model, version, _ = self._current
+        return model, version
+
+    def _stat_source(self):
+        if self.source is None:
+            return None
+        try:
+            st = os.stat(self.source)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _check_source(self):
+        source_stat = self._stat_source()
+        if source_stat is not None and source_stat != self._source_stat and self._reload_lock.acquire(blocking=False):
+            threading.Thread(target=self._import_source, args=(source_stat,), daemon=True).start()
+            return
+        try:
+            stamp = self._stamp()
+        except FileNotFoundError:
+            return
+        if stamp is not None and stamp != self._current[2] and self._reload_lock.acquire(blocking=False):
+            threading.Thread(target=self._reload, args=(stamp,), daemon=True).start()
+
+    def _reload(self, stamp):
+        try:
+            self._swap(self._load(stamp), stamp)
+        except Exception:
+            # Fichero a medio escribir o corrupto: seguimos con el modelo actual y se reintenta en la siguiente comprobación
+            pass
+        finally:
+            self._reload_lock.release()
+
+    def _import_source(self, source_stat):
+        try:
+            # Si el contenido no ha cambiado (o ya lo ha importado otro worker) no se crea versión
+            self.store.import_file(self.source, metrics={'source': self.source}, if_changed=True)
+            self._source_stat = source_stat
+            stamp = self._stamp()
+            if stamp != self._current[2]:
+                self._swap(self._load(stamp), stamp)
+        except Exception:
+            # Fichero a medio escribir o corrupto: no se importa y se reintenta en la siguiente comprobación
+            pass
+        finally:
+            self._reload_lock.release()
+
+    def _swap(self, model, stamp):
+        with self._swap_lock:
+            self._current = (model, self._current[1] + 1, stamp)
+
+    def publish(self, model, metrics=None):
+        """
+        Guarda un modelo nuevo en disco y lo pone en servicio en este proceso sin esperar a la detección por mtime.
+        Con almacén, se guarda como versión nueva junto con `metrics` y se devuelve su nombre.
+        """
+        if self.store is not None:
+            version = self.store.publish(model, metrics)
+            self._swap(self._load(version), version)
+            return version
+        self._dump(model)
+        mtime = os.stat(self.path).st_mtime_ns
+        self._swap(self._load(mtime) if self.is_artifact else model, mtime)
+
+    def activate(self, version):
+        """Pone en servicio `version` del almacén en todos los procesos (p. ej. promover la candidata) y la sirve ya en este."""
+        if self.store is None:
+            raise RuntimeError("Activating a version needs a model store")
+        self.store.activate(version)
+        self._swap(self._load(version), version)
+        return version
+
+    def rollback(self, version=None):
+        """Vuelve a `version` (o a la anterior) del almacén en todos los procesos y la sirve ya en este. Devuelve su nombre."""
+        if self.store is None:
+            raise RuntimeError("Rollback needs a model store")
+        version = self.store.rollback(version)
+        self._swap(self._load(version), version)
+        return version
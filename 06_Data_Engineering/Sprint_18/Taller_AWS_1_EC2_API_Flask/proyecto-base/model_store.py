@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import time
+
+from artifact import export_linear_model, load_linear_model
+from atomic_io import atomic_write, fsync_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+_VERSION_RE = re.compile(r'^v(\d{6})$')
+_FILES = {'json': 'model.json', 'pkl': 'model.pkl'}
+
+
+def _to_builtin(value):
+    # Para json.dump: escalares de NumPy (np.float64, np.int64, np.bool_) que puedan venir en las métricas
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _fsync_file(path):
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+
+class ModelStore:
+    """
+    Almacén de versiones del modelo en disco:
+
+        root/
+          v000001/  model.json (o model.pkl) + info.json (métricas y fecha)
+          v000002/
+          CURRENT   nombre de la versión en servicio
+          CANDIDATE versión candidata que se evalúa en modo sombra (ver shadow.py), si la hay
+
+    Cada versión se escribe completa en un directorio temporal (con fsync de los ficheros) y se renombra
+    a vNNNNNN, así que nunca hay una versión a medias. Después se reescribe CURRENT con otro rename
+    atómico: quien lo lee ve la versión anterior o la nueva, y cambiar de versión o volver atrás es
+    reescribir ese puntero, sin copiar modelos. Se guardan las últimas `keep` versiones (y siempre la actual
+    y la candidata).
+
+    `fmt` es el formato de las versiones nuevas: 'json' (artefacto lineal, se carga sólo con NumPy) o 'pkl'.
+    """
+
+    POINTER = 'CURRENT'
+    CANDIDATE = 'CANDIDATE'
+
+    def __init__(self, root, keep=5, fmt='json'):
+        if fmt not in _FILES:
+            raise ValueError(f"fmt must be one of {tuple(_FILES)}, got {fmt!r}")
+        self.root = root
+        self.keep = keep
+        self.fmt = fmt
+        os.makedirs(root, exist_ok=True)
+
+    # -- Lectura -------------------------------------------------------------------------------------
+
+    def versions(self):
+        """Versiones guardadas, de la más antigua a la más reciente."""
+        return sorted(name for name in os.listdir(self.root)
+                      if _VERSION_RE.match(name) and os.path.isdir(os.path.join(self.root, name)))
+
+    def _read_pointer(self, name):
+        try:
+            with open(os.path.join(self.root, name)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def current(self):
+        """Versión en servicio según CURRENT, o None si todavía no se ha publicado ninguna."""
+        return self._read_pointer(self.POINTER)
+
+    def candidate(self):
+        """Versión candidata según CANDIDATE, o None si no hay ninguna en evaluación."""
+        return self._read_pointer(self.CANDIDATE)
+
+    def info(self, version):
+        with open(os.path.join(self.root, version, 'info.json')) as f:
+            return json.load(f)
+
+    def describe(self):
+        """Lista de versiones (más reciente primero) con sus métricas, indicando cuál está en servicio."""
+        current, candidate = self.current(), self.candidate()
+        return [{**self.info(version), 'version': version, 'current': version == current, 'candidate': version == candidate}
+                for version in reversed(self.versions())]
+
+    def load(self, version):
+        info = self.info(version)
+        return self._load_file(os.path.join(self.root, version, info['file']), info['format'])
+
+    @staticmethod
+    def _load_file(path, fmt):
+        if fmt == 'json':
+            return load_linear_model(path)
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def last_import(self, path):
+        """Datos (path, sha256, mtime_ns) del último import_file de `path`, o None si nunca se ha importado."""
+        path = os.path.abspath(path)
+        for version in reversed(self.versions()):
+            source = self.info(version).get('source')
+            if source is not None and source['path'] == path:
+                return source
+        return None
+
+    # -- Escritura -----------------------------------------------------------------------------------
+
+    def _lock(self):
+        # Serializa publish/activate/prune entre procesos; devuelve el descriptor que hay que cerrar
+        fd = os.open(os.path.join(self.root, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _next_version(self):
+        versions = self.versions()
+        number = int(_VERSION_RE.match(versions[-1]).group(1)) + 1 if versions else 1
+        return f'v{number:06d}'
+
+    def _commit(self, write, fmt, metrics, activate=True, skip=None, source=None):
+        # `write(path)` escribe el modelo en `path`; aquí se hace el resto: info.json, fsync, rename y puntero.
+        # Si `skip()`, evaluado ya con el lock cogido, devuelve True, no se crea versión
+        fd = self._lock()
+        try:
+            if skip is not None and skip():
+                return self.current()
+            version = self._next_version()
+            tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+            try:
+                model_path = os.path.join(tmp_dir, _FILES[fmt])
+                write(model_path)
+                _fsync_file(model_path)
+                info_path = os.path.join(tmp_dir, 'info.json')
+                with open(info_path, 'w') as f:
+                    info = {'format': fmt, 'file': _FILES[fmt], 'created_at': time.time(), 'metrics': metrics or {}}
+                    if source is not None:
+                        info['source'] = source
+                    json.dump(info, f, indent=2, default=_to_builtin)
+                    f.flush()
+                    os.fsync(f.fileno())
+                fsync_dir(tmp_dir)
+                os.rename(tmp_dir, os.path.join(self.root, version))
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+            fsync_dir(self.root)
+            self._set_pointer(version, self.POINTER if activate else self.CANDIDATE)
+            self._prune()
+        finally:
+            os.close(fd)
+        return version
+
+    def publish(self, model, metrics=None, activate=True):
+        """
+        Guarda `model` como versión nueva y devuelve su nombre. La pone en servicio o, con `activate=False`,
+        la deja como candidata para evaluarla en modo sombra antes de promoverla con activate().
+        """
+        if self.fmt == 'json':
+            return self._commit(lambda path: export_linear_model(model, path), 'json', metrics, activate=activate)
+
+        def write_pickle(path):
+            with open(path, 'wb') as f:
+                pickle.dump(model, f)
+        return self._commit(write_pickle, 'pkl', metrics, activate=activate)
+
+    def import_file(self, path, metrics=None, if_changed=False):
+        """
+        Crea una versión a partir de un modelo ya guardado (ad_model.json o ad_model.pkl) y la pone en servicio.
+        La versión guarda de qué fichero sale y su sha256, y antes de publicarla se comprueba que se puede cargar.
+
+        Con `if_changed` sólo lo hace si el contenido del fichero ha cambiado desde su último import (así
+        varios workers que arrancan o detectan el cambio a la vez importan una sola versión), o si el almacén
+        está vacío. Si el fichero no se ha importado nunca pero ya hay versiones (almacén creado antes de
+        guardar el origen), sólo se importa si es más reciente que la versión en servicio.
+        """
+        fmt = 'json' if path.endswith('.json') else 'pkl'
+        source = {'path': os.path.abspath(path), 'sha256': _sha256(path), 'mtime_ns': os.stat(path).st_mtime_ns}
+
+        def unchanged():
+            current = self.current()
+            if current is None:
+                return False
+            last = self.last_import(path)
+            if last is not None:
+                return last['sha256'] == source['sha256']
+            return source['mtime_ns'] / 1e9 <= self.info(current)['created_at']
+
+        def copy_checked(dst):
+            shutil.copyfile(path, dst)
+            self._load_file(dst, fmt)  # Un fichero a medio escribir o corrupto no llega a ser versión
+            source['sha256'] = _sha256(dst)  # El de lo copiado, por si el fichero ha cambiado entre medias
+
+        return self._commit(copy_checked, fmt, metrics, skip=unchanged if if_changed else None, source=source)
+
+    def _set_pointer(self, version, name=POINTER):
+        atomic_write(os.path.join(self.root, name), version)
+
+    def activate(self, version):
+        """Pone en servicio una versión guardada. Si era la candidata, deja de haber candidata."""
+        fd = self._lock()
+        try:
+            if version not in self.versions():
+                raise KeyError(f"Unknown model version: {version}")
+            self._set_pointer(version)
+            if self.candidate() == version:
+                self._clear_candidate()
+        finally:
+            os.close(fd)
+        return version
+
+    def set_candidate(self, version):
+        """Marca una versión guardada como candidata para el modo sombra."""
+        fd = self._lock()
+        try:
+            if version not in self.versions():
+                raise KeyError(f"Unknown model version: {version}")
+            self._set_pointer(version, self.CANDIDATE)
+        finally:
+            os.close(fd)
+        return version
+
+    def clear_candidate(self):
+        """Descarta la candidata (la versión sigue guardada hasta que la retire la poda)."""
+        fd = self._lock()
+        try:
+            self._clear_candidate()
+        finally:
+            os.close(fd)
+
+    def _clear_candidate(self):
+        try:
+            os.remove(os.path.join(self.root, self.CANDIDATE))
+        except FileNotFoundError:
+            return
+        fsync_dir(self.root)
+
+    def rollback(self, version=None):
+        """Vuelve a `version` o, si no se indica, a la versión anterior a la actual. Devuelve la versión activada."""
+        if version is None:
+            current = self.current()
+            older = [v for v in self.versions() if current is None or v < current]
+            if not older:
+                raise KeyError("No previous model version to roll back to")
+            version = older[-1]
+        return self.activate(version)
+
+    def _prune(self):
+        # Se llama con el lock cogido. Nunca borra la versión en servicio ni la candidata
+        keep = {self.current(), self.candidate()}
+        stale = [v for v in self.versions()[:-self.keep] if v not in keep] if self.keep else []
+        for version in stale:
+            shutil.rmtree(os.path.join(self.root, version), ignore_errors=True)
@@ -0,0 +1,101 @@
+import io
+import json
+
+import numpy as np
+
+from schema import ADVERTISING, SchemaError
+
+# Todas las rutas acaban en el esquema (schema.py): filas posicionales con from_rows, columnas con nombre
+# (JSON, cabecera CSV, Arrow) con from_columns. Ambos devuelven una matriz float64 contigua de n filas x
+# las features en el orden del modelo, ya validada (presencia, orden y rangos)
+SCHEMA = ADVERTISING
+FEATURES = list(SCHEMA.names)
+
+
+class PayloadError(SchemaError):
+    """Cuerpo de petición que no se puede leer (formato, Content-Type). Lleva el código HTTP a devolver."""
+
+
+def parse_json(body):
+    """
+    Acepta una lista de filas [[tv, radio, newspaper], ...], un objeto {"rows": [...]}
+    o un objeto por columnas {"tv": [...], "radio": [...], "newspaper": [...]}.
+    """
+    if isinstance(body, dict):
+        if 'rows' in body:
+            return SCHEMA.from_rows(body['rows'])
+        return SCHEMA.from_columns(body)
+    if isinstance(body, list):
+        return SCHEMA.from_rows(body)
+    raise PayloadError("JSON body must be a list of rows or an object")
+
+
+def _is_numeric_row(line):
+    try:
+        [float(value) for value in line.split(',')]
+    except ValueError:
+        return False
+    return True
+
+
+def parse_csv(body):
+    """CSV con o sin cabecera. Con cabecera, las columnas se buscan por nombre; sin ella, se toman en el orden de FEATURES."""
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        raise PayloadError("CSV body must be UTF-8 text")
+    has_header = not _is_numeric_row(text.split('\n', 1)[0])
+
+    import pandas as pd  # Sólo las peticiones CSV necesitan el parser de pandas
+
+    try:
+        df = pd.read_csv(io.StringIO(text), header=0 if has_header else None)
+    except (ValueError, pd.errors.ParserError) as e:
+        raise PayloadError(f"Invalid CSV: {e}")
+    if has_header:
+        return SCHEMA.from_columns({name: df[name].to_numpy() for name in df.columns})
+    return SCHEMA.from_rows(df.to_numpy())
+
+
+def parse_npy(body):
+    """Array NumPy serializado con np.save (sin pickle)."""
+    try:
+        values = np.load(io.BytesIO(body), allow_pickle=False)
+    except (ValueError, OSError) as e:
+        raise PayloadError(f"Invalid .npy payload: {e}")
+    return SCHEMA.from_rows(values)
+
+
+def parse_arrow(body):
+    """Tabla Arrow en formato IPC stream con columnas tv, radio y newspaper. Necesita pyarrow."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise PayloadError("Arrow payloads require pyarrow on the server", status=415)
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+    except pa.ArrowInvalid as e:
+        raise PayloadError(f"Invalid Arrow payload: {e}")
+    return SCHEMA.from_columns({name: table.column(name).to_numpy() for name in table.column_names})
+
+
+PARSERS = {
+    'text/csv': parse_csv,
+    'application/x-npy': parse_npy,
+    'application/octet-stream': parse_npy,
+    'application/vnd.apache.arrow.stream': parse_arrow,
+}
+
+
+def parse_body(data, mimetype):
+    """Convierte un cuerpo de petición (bytes) en una matriz float64 (n, 3), según su Content-Type."""
+    if mimetype == 'application/json' or mimetype.endswith('+json'):
+        try:
+            body = json.loads(data)
+        except ValueError:
+            raise PayloadError("Invalid JSON body")
+        return parse_json(body)
+    parser = PARSERS.get(mimetype)
+    if parser is None:
+        raise PayloadError(f"Unsupported Content-Type: {mimetype}", status=415)
+    return parser(data)
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    Caché LRU de predicciones con caducidad, para entradas (tv, radio, newspaper) que se repiten.
+
+    Las claves llevan la versión del modelo: en cuanto se ve una versión nueva (tras un retrain o una
+    recarga del registro) se vacía la caché entera y se ignoran las escrituras de versiones anteriores,
+    así que nunca se sirve una predicción de un modelo retirado.
+
+    Guarda como mucho `maxsize` entradas (se descarta la usada hace más tiempo) y cada una vale `ttl` segundos.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        # Se llama con el lock cogido. Devuelve False si la versión es anterior a la vigente
+        if self._version is None or version > self._version:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._version = version
+        return version == self._version
+
+    def get(self, key, version):
+        """Devuelve la predicción cacheada para `key` con el modelo `version`, o None si no está o ha caducado."""
+        now = time.monotonic()
+        with self._lock:
+            if self._check_version(version):
+                entry = self._data.get(key)
+                if entry is not None and entry[1] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                if entry is not None:
+                    del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, value):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if not self._check_version(version):
+                return
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl_s': self.ttl,
+                'model_version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
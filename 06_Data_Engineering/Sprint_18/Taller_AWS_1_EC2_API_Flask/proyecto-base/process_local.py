@@ -0,0 +1,41 @@
+import os
+import threading
+
+
+class ProcessLocal:
+    """
+    Un valor que se crea una vez en cada proceso, pensado para los hilos de fondo, que no sobreviven al fork.
+
+    get() llama a `setup()` la primera vez en cada proceso (en el master y, tras el fork de gunicorn, en cada
+    worker) y después devuelve lo que devolvió; el camino rápido es comparar el pid. Con `eager=True` se crea
+    al construirlo y de nuevo en el hijo justo después de cada fork, sin esperar a la primera llamada.
+    """
+
+    def __init__(self, setup, eager=False):
+        self._setup = setup
+        self._eager = eager
+        self._lock = threading.Lock()
+        self._pid = None
+        self._value = None
+        os.register_at_fork(after_in_child=self._after_fork)
+        if eager:
+            self.get()
+
+    def get(self):
+        if self._pid == os.getpid():
+            return self._value
+        with self._lock:
+            if self._pid != os.getpid():
+                self._value = self._setup()
+                self._pid = os.getpid()
+        return self._value
+
+    def peek(self):
+        """El valor de este proceso, o None si aquí todavía no se ha creado (no llama a `setup`)."""
+        return self._value if self._pid == os.getpid() else None
+
+    def _after_fork(self):
+        # El lock pudo quedar cogido por un hilo del padre que no existe en el hijo
+        self._lock = threading.Lock()
+        if self._eager:
+            self.get()
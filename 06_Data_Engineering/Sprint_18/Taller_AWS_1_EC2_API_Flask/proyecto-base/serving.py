@@ -0,0 +1,368 @@
+import math
+import os
+import time
+
+import numpy as np
+
+from coalescer import PredictionCoalescer
+from jobs import JobAlreadyRunning, JobRunner
+from logging_setup import configure_logging
+from metrics import CONTENT_TYPE, MetricsRegistry, WSGIMetricsMiddleware, current_endpoint
+from model_registry import ModelRegistry
+from model_store import ModelStore
+from payloads import SCHEMA, parse_body
+from prediction_cache import PredictionCache
+from schema import SchemaError
+from shadow import ShadowEvaluator
+
+# Ficheros que necesita el núcleo: son los que hay que copiar junto a la app al empaquetarla fuera de
+# esta carpeta (ver make_bundle.py de la API de Elastic Beanstalk)
+MODULES = ['serving.py', 'artifact.py', 'atomic_io.py', 'coalescer.py', 'jobs.py', 'logging_setup.py', 'metrics.py',
+           'model_registry.py', 'model_store.py', 'payloads.py', 'prediction_cache.py', 'process_local.py', 'schema.py',
+           'shadow.py']
+
+_STORE_DISABLED = ({'error': 'Model store disabled (MODEL_STORE is empty)'}, 404)
+_PROBE_ROW = np.zeros((1, SCHEMA.width))  # Fila con la que readiness comprueba que el modelo predice
+
+
+class ServingCore:
+    """
+    Núcleo de servicio del modelo, común a todas las APIs de este proyecto: app.py (EC2), application.py
+    (Elastic Beanstalk) y, sin el agrupador, asgi_app.py (Quart). Reúne el registro y el almacén de versiones
+    del modelo, el agrupador de predicciones, la caché, el modo sombra, las métricas Prometheus y los endpoints
+    de salud, configurados con las mismas variables de entorno que antes (MODEL_PATH, MODEL_STORE, MODEL_KEEP,
+    COALESCE_*, PREDICT_CACHE_*, SHADOW_MAX_PENDING). Con `retrain_data` (el CSV de datos nuevos) también el
+    reentrenamiento en segundo plano (RETRAIN_*); sin él, como en Elastic Beanstalk, no hay rutas de retrain.
+
+    Cada handler devuelve (cuerpo, status[, cabeceras]) sin tocar el framework: init_app(app) los registra en
+    una app Flask con los nombres de endpoint de siempre (las métricas por endpoint no cambian) y asgi_app.py
+    los envuelve en rutas async. Lo propio de cada despliegue (la portada) queda en su app.
+    """
+
+    def __init__(self, model_path=None, coalesce=True, metrics_prefix='advertising_api_', retrain_data=None):
+        self.started_at = time.time()
+
+        # Logs estructurados (JSON) escritos desde un hilo aparte; el detalle por petición sólo se registra para
+        # una muestra de cada endpoint (LOG_SAMPLE_RATES) y el nivel se elige con LOG_LEVEL
+        self.log, self.sampler = configure_logging()
+
+        # Métricas de rendimiento, expuestas en /metrics. Se crean antes que el registro para medir también la primera carga del modelo.
+        # Con METRICS_DIR (lo pone gunicorn.conf.py) /metrics suma las de todos los workers, responda el que responda
+        self.metrics = metrics = MetricsRegistry(prefix=metrics_prefix, multiprocess_dir=os.environ.get('METRICS_DIR'))
+        self.request_latency = metrics.histogram('request_duration_seconds', 'Tiempo de respuesta por endpoint', ['endpoint', 'method'])
+        self.inference_time = metrics.histogram('inference_duration_seconds', 'Tiempo de predict del modelo', ['mode'])
+        self.load_time = metrics.histogram('model_load_duration_seconds', 'Tiempo de carga (unpickle o JSON) del modelo')
+        self.parse_time = metrics.histogram('payload_parse_duration_seconds', 'Tiempo de conversión del cuerpo batch a matriz', ['content_type'])
+        self.errors = metrics.counter('errors_total', 'Respuestas con status >= 400 por endpoint', ['endpoint', 'status'])
+
+        # Por defecto se sirve el artefacto JSON (coeficientes + intercept, se carga sólo con NumPy); si no existe, el pickle.
+        # Cada modelo publicado se guarda como versión en MODEL_STORE (las últimas MODEL_KEEP, con sus métricas) y los
+        # workers sirven la que indica el puntero MODEL_STORE/CURRENT (ver model_store.py). MODEL_PATH se importa como
+        # versión al arrancar y cada vez que su contenido cambia (git pull, salida de model.py), y pasa a servirse.
+        # Con MODEL_STORE vacío se sirve MODEL_PATH directamente, recargándolo por mtime
+        self.model_path = model_path or os.environ.get(
+            'MODEL_PATH', 'ad_model.json' if os.path.exists('ad_model.json') else 'ad_model.pkl')
+        store_dir = os.environ.get('MODEL_STORE', 'models')
+        if store_dir:
+            self.store = ModelStore(store_dir, keep=int(os.environ.get('MODEL_KEEP', 5)),
+                                    fmt='json' if self.model_path.endswith('.json') else 'pkl')
+            self.store.import_file(self.model_path, metrics={'source': self.model_path}, if_changed=True)
+            self.registry = ModelRegistry(store=self.store, source=self.model_path, on_load=self.load_time.labels().observe)
+        else:
+            self.store = None
+            self.registry = ModelRegistry(self.model_path, on_load=self.load_time.labels().observe)
+
+        # Modo sombra: el candidato de MODEL_STORE/CANDIDATE se puntúa con el tráfico real en un hilo de fondo (ver shadow.py)
+        self.shadow = ShadowEvaluator(self.store, max_pending=int(os.environ.get('SHADOW_MAX_PENDING', 10000)),
+                                      on_inference=self.inference_time.labels('shadow').observe) if self.store is not None else None
+
+        # Las peticiones concurrentes de una fila se agrupan en lotes de hasta COALESCE_MAX_BATCH filas o
+        # COALESCE_MAX_WAIT_MS milisegundos; sólo se espera si hay otras en curso, una petición sola no paga la
+        # espera. Sin agrupador (coalesce=False) cada fila se predice en línea
+        self.coalescer = PredictionCoalescer(self.registry.get,
+                                             max_batch=int(os.environ.get('COALESCE_MAX_BATCH', 64)),
+                                             max_wait_ms=float(os.environ.get('COALESCE_MAX_WAIT_MS', 2)),
+                                             on_inference=self.inference_time.labels('coalesced').observe) if coalesce else None
+
+        # Caché LRU de predicciones por (tv, radio, newspaper) y versión del modelo, con tamaño máximo y caducidad en segundos
+        self.cache = PredictionCache(maxsize=int(os.environ.get('PREDICT_CACHE_SIZE', 10000)),
+                                     ttl=float(os.environ.get('PREDICT_CACHE_TTL', 300)))
+
+        # Los reentrenamientos se ejecutan de uno en uno en un hilo de fondo, también entre workers de gunicorn (retrain.lock);
+        # su estado se guarda en jobs/<id>.json para que cualquier worker pueda responder a /api/v1/retrain/<job_id>.
+        # Por defecto el retrain relee y reajusta todo el CSV (mode=full), con el split de test de siempre. Con
+        # ?mode=incremental (o RETRAIN_MODE=incremental) sólo lee las filas añadidas desde el anterior (estado en
+        # RETRAIN_STATE_PATH); su test se elige por número de fila, así que su RMSE/MAPE no se comparan con los de
+        # full (ver training.train_incremental). Con ?mode=tune además se elige alpha por validación cruzada (?criterion=rmse o mape).
+        # Con ?publish=shadow (o RETRAIN_PUBLISH=shadow) el modelo no se publica: queda como candidato y se evalúa
+        # en modo sombra con el tráfico real hasta promoverlo con POST /api/v1/shadow/promote
+        self.retrain_data = retrain_data
+        if retrain_data is not None:
+            self.retrain_mode = os.environ.get('RETRAIN_MODE', 'full')
+            self.retrain_state_path = os.environ.get('RETRAIN_STATE_PATH', 'retrain_state.npz')
+            self.retrain_publish = os.environ.get('RETRAIN_PUBLISH', 'live')  # 'live' o 'shadow' (se cambia con ?publish=)
+            self.jobs = JobRunner(lock_path='retrain.lock', state_dir='jobs')
+            self.retrains = metrics.counter('retrains_total', 'Reentrenamientos por resultado', ['outcome'])
+        else:
+            self.jobs = None
+
+        self._register_callbacks()
+
+    def _register_callbacks(self):
+        # Estadísticas que ya llevan el registro, la caché, el agrupador y el modo sombra: se leen sólo cuando se pide /metrics
+        metrics, cache, coalescer, shadow = self.metrics, self.cache, self.coalescer, self.shadow
+        metrics.callback('model_version', 'Versión del modelo en servicio en este proceso', lambda: self.registry.version)
+        if shadow is not None:
+            metrics.callback('shadow_rows', 'Filas puntuadas con el modelo candidato', lambda: shadow.stats()['rows'])
+            metrics.callback('shadow_dropped', 'Envíos descartados por tener la cola del modo sombra llena', lambda: shadow.stats()['dropped'])
+            metrics.callback('shadow_mean_abs_difference', 'Diferencia absoluta media entre candidato y modelo en servicio',
+                             lambda: (shadow.stats()['difference'] or {}).get('mean_abs', float('nan')))
+        metrics.callback('cache_entries', 'Entradas en la caché de predicciones', lambda: cache.stats()['size'], aggregate='sum')
+        metrics.callback('cache_lookups_total', 'Consultas a la caché de predicciones por resultado',
+                         lambda: {('hit',): cache.stats()['hits'], ('miss',): cache.stats()['misses']}, ['result'], kind='counter')
+        metrics.callback('cache_evictions_total', 'Entradas descartadas por tamaño', lambda: cache.stats()['evictions'], kind='counter')
+        if coalescer is not None:
+            metrics.callback('coalescer_batches_total', 'Lotes predichos por el agrupador', lambda: coalescer.stats()['batches'], kind='counter')
+            metrics.callback('coalescer_rows_total', 'Filas predichas por el agrupador', lambda: coalescer.stats()['rows'], kind='counter')
+            metrics.callback('coalescer_mean_queue_delay_seconds', 'Espera media de una fila en la cola del agrupador',
+                             lambda: coalescer.stats()['mean_queue_delay_ms'] / 1000)
+
+    # -- Predicción ----------------------------------------------------------------------------------
+
+    def predict_row(self, row):
+        """Predice una fila ya validada (caché, después agrupador o predicción en línea) y devuelve (predicción, versión)."""
+        model, version = self.registry.current()  # También detecta un modelo nuevo aunque la predicción salga de la caché
+        prediction = self.cache.get(row, version)
+        if prediction is None:
+            if self.coalescer is not None:
+                prediction = self.coalescer.predict(row)
+            else:
+                # Predicción en línea: es tan barata que no compensa mandarla a un hilo
+                started = time.perf_counter()
+                prediction = float(model.predict(np.array([row]))[0])
+                self.inference_time.labels('single').observe(time.perf_counter() - started)
+            self.cache.put(row, version, prediction)
+        if self.shadow is not None:
+            self.shadow.observe((row,), (prediction,))  # Sólo encola: el candidato se evalúa en segundo plano
+        return prediction, version
+
+    def predict_args(self, args):
+        """GET /api/v1/predict: tv, radio y newspaper validados con el esquema (400/422 con el detalle de cada campo)."""
+        try:
+            row = SCHEMA.parse_args(args)
+        except SchemaError as e:
+            return e.to_dict(), e.status
+        prediction, version = self.predict_row(row)
+        if self.sampler.sample('predict'):
+            self.log.info('predict', extra={'fields': {'tv': row[0], 'radio': row[1], 'newspaper': row[2],
+                                                       'prediction': prediction, 'model_version': version}})
+        return {'predictions': prediction}, 200
+
+    def predict_body(self, data, mimetype):
+        """POST /api/v1/predict/batch: miles de filas (JSON, CSV, .npy o Arrow) predichas con una única llamada vectorizada."""
+        try:
+            started = time.perf_counter()
+            X = parse_body(data, mimetype)
+            self.parse_time.labels(mimetype).observe(time.perf_counter() - started)
+        except SchemaError as e:  # También PayloadError (formato o Content-Type no válidos)
+            self.log.warning('invalid batch payload', extra={'fields': {'error': str(e), 'content_type': mimetype}})
+            return e.to_dict(), e.status
+
+        started = time.perf_counter()
+        predictions = self.registry.get().predict(X)
+        self.inference_time.labels('batch').observe(time.perf_counter() - started)
+        if self.shadow is not None:
+            self.shadow.observe(X, predictions)
+        if self.sampler.sample('predict_batch'):
+            self.log.info('predict_batch', extra={'fields': {'rows': len(X), 'content_type': mimetype}})
+        return {'predictions': predictions.tolist()}, 200
+
+    def predict_stats(self):
+        """GET /api/v1/predict/stats: agrupador (lotes, retardo en cola) y caché (aciertos/fallos)."""
+        return {'coalescer': self.coalescer.stats() if self.coalescer is not None else None,
+                'cache': self.cache.stats()}, 200
+
+    # -- Versiones del modelo y modo sombra ----------------------------------------------------------
+
+    def model_versions(self):
+        """GET /api/v1/models: versiones guardadas, con sus métricas, y cuál está en servicio."""
+        if self.store is None:
+            return _STORE_DISABLED
+        return {'current': self.store.current(), 'versions': self.store.describe()}, 200
+
+    def model_rollback(self, version=None):
+        """POST /api/v1/models/rollback: vuelve a la versión anterior, o a `version`, en todos los workers."""
+        if self.store is None:
+            return _STORE_DISABLED
+        try:
+            version = self.registry.rollback(version)
+        except KeyError as e:
+            return {'error': e.args[0]}, 404
+        self.log.info('model rolled back', extra={'fields': {'stored_version': version, 'model_version': self.registry.version}})
+        return {'current': version, 'model_version': self.registry.version}, 200
+
+    def shadow_stats(self):
+        """GET /api/v1/shadow: candidato en evaluación, diferencias con el modelo en servicio y deriva de las entradas."""
+        if self.shadow is None:
+            return _STORE_DISABLED
+        return self.shadow.stats(), 200
+
+    def shadow_promote(self):
+        """
+        POST /api/v1/shadow/promote: pone el candidato en servicio en todos los workers. Devuelve como evidencia
+        los estadísticos del modo sombra sumados de todos los workers (ver ShadowEvaluator.stats).
+        """
+        if self.shadow is None:
+            return _STORE_DISABLED
+        version = self.store.candidate()
+        if version is None:
+            return {'error': 'No candidate model to promote'}, 409
+        evidence = self.shadow.stats()
+        self.registry.activate(version)
+        self.shadow.check()
+        self.log.info('candidate promoted', extra={'fields': {'stored_version': version, 'model_version': self.registry.version,
+                                                              'shadow_rows': evidence['rows']}})
+        return {'current': version, 'model_version': self.registry.version, 'shadow': evidence}, 200
+
+    def shadow_discard(self):
+        """POST /api/v1/shadow/discard: descarta el candidato sin tocar el modelo en servicio."""
+        if self.shadow is None:
+            return _STORE_DISABLED
+        version = self.store.candidate()
+        self.store.clear_candidate()
+        self.shadow.check()
+        return {'discarded': version}, 200
+
+    # -- Reentrenamiento -----------------------------------------------------------------------------
+
+    def served_alpha(self):
+        # Alpha del modelo en servicio (Lasso de sklearn o artefacto JSON): el retrain incremental lo mantiene
+        model = self.registry.get()
+        return getattr(model, 'alpha', None) or getattr(model, 'metadata', {}).get('params', {}).get('alpha')
+
+    def train_and_publish(self, mode, criterion='rmse', publish='live'):
+        """Reentrena el modelo con los datos nuevos y lo publica (o lo deja de candidato); se ejecuta como job en segundo plano."""
+        from training import train, train_incremental  # pandas y sklearn se importan en el primer reentrenamiento, no al arrancar el servidor
+
+        try:
+            if mode == 'incremental':
+                model, scores = train_incremental(self.retrain_data, self.retrain_state_path, alpha=self.served_alpha())
+            else:
+                model, scores = train(self.retrain_data, tune=(mode == 'tune'), criterion=criterion)
+            if publish == 'shadow':
+                stored_version = self.store.publish(model, scores, activate=False)  # Candidato: se evalúa en sombra antes de promoverlo
+            else:
+                stored_version = self.registry.publish(model, metrics=scores)
+        except Exception:
+            self.retrains.inc('failed')
+            self.log.exception('retrain failed')
+            raise
+        self.retrains.inc('finished')
+        self.log.info('model retrained', extra={'fields': {**scores, 'publish': publish, 'model_version': self.registry.version,
+                                                           'stored_version': stored_version}})
+        return scores
+
+    def retrain(self, args, status_url=None):
+        """
+        GET /api/v1/retrain/: lanza el reentrenamiento como job en segundo plano y devuelve su id al momento (202),
+        o 409 con el id del que ya está en marcha. `status_url(job_id)` construye la URL de su estado.
+        """
+        status_url = status_url or (lambda job_id: f'/api/v1/retrain/{job_id}')
+        mode = args.get('mode', self.retrain_mode)
+        criterion = args.get('criterion', 'rmse')
+        publish = args.get('publish', self.retrain_publish)
+        if mode not in ('incremental', 'full', 'tune'):
+            return {'error': "mode must be 'incremental', 'full' or 'tune'"}, 400
+        if criterion not in ('rmse', 'mape'):
+            return {'error': "criterion must be 'rmse' or 'mape'"}, 400
+        if publish not in ('live', 'shadow'):
+            return {'error': "publish must be 'live' or 'shadow'"}, 400
+        if publish == 'shadow' and self.store is None:
+            return {'error': 'Shadow mode needs the model store (MODEL_STORE is empty)'}, 400
+        if not os.path.exists(self.retrain_data):
+            return "<h2>New data for retrain NOT FOUND. Nothing done!</h2>", 200
+        try:
+            job_id = self.jobs.submit(self.train_and_publish, mode, criterion, publish)
+        except JobAlreadyRunning as e:
+            self.retrains.inc('rejected')
+            self.log.info('retrain rejected, already running', extra={'fields': {'job_id': e.job_id}})
+            return {'error': 'A retrain is already in progress', 'job_id': e.job_id, 'status_url': status_url(e.job_id)}, 409
+        return {'job_id': job_id, 'status_url': status_url(job_id)}, 202
+
+    def retrain_status(self, job_id):
+        """GET /api/v1/retrain/<job_id>: estado del job y RMSE/MAPE cuando termina."""
+        job = self.jobs.status(job_id)
+        if job is None:
+            return {'error': 'Unknown job id'}, 404
+        return job, 200
+
+    # -- Salud y métricas ----------------------------------------------------------------------------
+
+    def health(self):
+        """GET /healthz (liveness): el proceso responde. No mira el modelo, para que el balanceador no lo reinicie por un fallo de carga."""
+        return {'status': 'ok', 'uptime_seconds': time.time() - self.started_at}, 200
+
+    def readiness(self):
+        """GET /readyz (readiness): hay un modelo publicado, cargado y que predice un valor finito; si no, 503."""
+        if self.store is not None and self.store.current() is None:
+            return {'status': 'not ready', 'reason': 'No model version published'}, 503
+        model, version = self.registry.current()
+        try:
+            probe = float(model.predict(_PROBE_ROW)[0])
+        except Exception as e:
+            return {'status': 'not ready', 'reason': f'Model cannot predict: {e}'}, 503
+        if not math.isfinite(probe):
+            return {'status': 'not ready', 'reason': 'Model predicts a non-finite value'}, 503
+        return {'status': 'ready', 'model_version': version, 'stored_version': self.registry.stored_version}, 200
+
+    def render_metrics(self):
+        """GET /metrics: latencias, tiempos de inferencia/carga/parseo, errores y estado de caché, agrupador y modo sombra."""
+        return self.metrics.render(), 200, {'Content-Type': CONTENT_TYPE}
+
+    # -- Montaje en Flask ----------------------------------------------------------------------------
+
+    def count_errors(self, response):
+        if response.status_code >= 400:
+            self.errors.labels(current_endpoint(), response.status_code).inc()
+        return response
+
+    def init_app(self, app):
+        """
+        Monta el núcleo en una app Flask: middleware de métricas, contador de errores y rutas de predicción, modelos,
+        sombra, reentrenamiento (si hay retrain_data), salud y /metrics.
+        """
+        from flask import jsonify, request, url_for  # Sólo al montarlo en Flask: asgi_app.py usa el núcleo con Quart
+
+        def respond(result):
+            body, *rest = result
+            return (jsonify(body) if isinstance(body, dict) else body, *rest)
+
+        app.config.setdefault('MAX_CONTENT_LENGTH', 64 * 1024 * 1024)  # Límite del cuerpo de las peticiones batch
+        # La latencia por endpoint se mide en un middleware WSGI alrededor de la app (ver metrics.py)
+        app.wsgi_app = WSGIMetricsMiddleware(app, self.request_latency)
+        app.after_request(self.count_errors)
+
+        routes = [
+            ('/api/v1/predict', 'predict', ['GET'], lambda: respond(self.predict_args(request.args))),
+            ('/api/v1/predict/stats', 'predict_stats', ['GET'], lambda: respond(self.predict_stats())),
+            ('/api/v1/predict/batch', 'predict_batch', ['POST'],
+             lambda: respond(self.predict_body(request.get_data(), request.mimetype))),
+            ('/api/v1/models', 'model_versions', ['GET'], lambda: respond(self.model_versions())),
+            ('/api/v1/models/rollback', 'model_rollback', ['POST'],
+             lambda: respond(self.model_rollback(request.args.get('version')))),
+            ('/api/v1/shadow', 'shadow_stats', ['GET'], lambda: respond(self.shadow_stats())),
+            ('/api/v1/shadow/promote', 'shadow_promote', ['POST'], lambda: respond(self.shadow_promote())),
+            ('/api/v1/shadow/discard', 'shadow_discard', ['POST'], lambda: respond(self.shadow_discard())),
+            ('/healthz', 'health', ['GET'], lambda: respond(self.health())),
+            ('/readyz', 'readiness', ['GET'], lambda: respond(self.readiness())),
+            ('/metrics', 'prometheus_metrics', ['GET'], lambda: respond(self.render_metrics())),
+        ]
+        if self.jobs is not None:
+            routes += [
+                ('/api/v1/retrain/', 'retrain', ['GET'], lambda: respond(self.retrain(
+                    request.args, lambda job_id: url_for('retrain_status', job_id=job_id)))),
+                ('/api/v1/retrain/<job_id>', 'retrain_status', ['GET'], lambda job_id: respond(self.retrain_status(job_id))),
+            ]
+        for rule, endpoint, methods, view in routes:
+            app.add_url_rule(rule, endpoint, view, methods=methods)
+        return app
@@ -0,0 +1,379 @@
+import json
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+
+from atomic_io import atomic_write
+from process_local import ProcessLocal
+
+
+class RunningStats:
+    """
+    Media, desviación, mínimo y máximo de `width` columnas, actualizados por lotes con el algoritmo de
+    Welford (combinación de Chan et al. para un lote entero): memoria constante, sin guardar las filas.
+    """
+
+    def __init__(self, width=1):
+        self.n = 0
+        self.mean = np.zeros(width)
+        self.m2 = np.zeros(width)  # Suma de cuadrados de las desviaciones respecto a la media
+        self.min = np.full(width, np.inf)
+        self.max = np.full(width, -np.inf)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+        if not len(values):
+            return
+        n_batch = len(values)
+        mean_batch = values.mean(axis=0)
+        total = self.n + n_batch
+        delta = mean_batch - self.mean
+        self.mean = self.mean + delta * n_batch / total
+        self.m2 = self.m2 + ((values - mean_batch) ** 2).sum(axis=0) + delta ** 2 * self.n * n_batch / total
+        self.min = np.minimum(self.min, values.min(axis=0))
+        self.max = np.maximum(self.max, values.max(axis=0))
+        self.n = total
+
+    def merge(self, other):
+        """Suma otro RunningStats (p. ej. el de otro worker) con la misma combinación de Chan et al."""
+        if not other.n:
+            return
+        total = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n / total
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.n * other.n / total
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.n = total
+
+    def to_dict(self):
+        return {'n': self.n, 'mean': self.mean.tolist(), 'm2': self.m2.tolist(),
+                'min': self.min.tolist(), 'max': self.max.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(len(data['mean']))
+        stats.n = data['n']
+        for name in ('mean', 'm2', 'min', 'max'):
+            setattr(stats, name, np.array(data[name], dtype=np.float64))
+        return stats
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.n) if self.n else np.full(len(self.mean), np.nan)
+
+    def column(self, i):
+        """Resumen de la columna `i` listo para JSON (None si aún no hay datos)."""
+        if not self.n:
+            return None
+        return {'mean': float(self.mean[i]), 'std': float(self.std[i]),
+                'min': float(self.min[i]), 'max': float(self.max[i])}
+
+
+def _ratio(a, b):
+    return float(a / b) if b else None
+
+
+class ShadowEvaluator:
+    """
+    Modo sombra: puntúa el tráfico real de predict con un modelo candidato sin tocar la respuesta.
+
+    El candidato es la versión del almacén (model_store.py) a la que apunta su puntero CANDIDATE, que se
+    comprueba como mucho cada `check_interval` segundos desde observe() y se carga en un hilo aparte, igual
+    que el modelo en servicio en ModelRegistry. observe(filas, predicciones) sólo añade las filas y lo que
+    respondió el modelo en servicio a una cola acotada (`max_pending` envíos; si está llena se descartan y
+    se cuentan). Un hilo de fondo la vacía cada `poll_interval` segundos y predice con el candidato en lotes
+    de hasta `max_batch` envíos: la petición no espera ni despierta a nadie, sólo hace un deque.append.
+
+    No hay valor real en una petición de predict, así que el "error" del candidato se mide contra el modelo
+    en servicio (diferencia candidata - servida: media, desviación, RMS, máxima y relativa) y la deriva de
+    las entradas contra las medias y desviaciones de las features con que se entrenó el candidato
+    (`feature_stats` de sus métricas, si las tiene). Todo son estadísticos acumulados en memoria constante.
+
+    Con varios workers, cada uno ve sólo su parte del tráfico: sus estadísticos (que se pueden combinar) se
+    vuelcan cada `publish_interval` segundos a store.root/shadow/<versión>/<worker>.json, y stats() suma los
+    de todos los workers, así que cualquier worker responde con el total. Se reinician cuando cambia el candidato.
+    Sin candidato, el hilo de fondo queda parado en un Event y no se despierta.
+    Si se pasa `on_inference`, se llama con los segundos que tarda cada predict del candidato.
+    """
+
+    def __init__(self, store, check_interval=1.0, max_pending=10000, max_batch=256, poll_interval=0.005,
+                 on_inference=None, publish_interval=1.0):
+        self.store = store
+        self.check_interval = check_interval
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.poll_interval = poll_interval
+        self.on_inference = on_inference
+        self.publish_interval = publish_interval
+        self._last_check = -math.inf
+        self._candidate = None  # (modelo, versión, feature_stats), sustituido de golpe como en ModelRegistry
+        self._has_candidate = threading.Event()  # El hilo de fondo espera en él mientras no hay candidato
+        self._load_lock = threading.Lock()
+        self._worker = ProcessLocal(self._start_worker)
+        self._worker_id = None  # Nombre del fichero de estadísticos de este worker
+        self._pending = deque()
+        self._stats_lock = threading.Lock()
+        self._reset_stats(None)
+
+    def _reset_stats(self, version):
+        with self._stats_lock:
+            self._version = version
+            self._rows = 0
+            self._dropped = 0
+            self._errors = 0
+            self._features = None  # Se crea con el ancho del primer lote
+            # Columnas: servida, candidata, diferencia, |diferencia|, |diferencia| relativa
+            self._predictions = RunningStats(5)
+            self._last_publish = -math.inf
+
+    # -- Candidato -----------------------------------------------------------------------------------
+
+    @property
+    def candidate_version(self):
+        candidate = self._candidate
+        return candidate[1] if candidate is not None else None
+
+    def check(self):
+        """Comprueba ya el puntero CANDIDATE (la carga, si hace falta, sigue siendo en segundo plano)."""
+        self._last_check = time.monotonic()
+        try:
+            version = self.store.candidate()
+        except OSError:
+            return
+        if version != self.candidate_version and self._load_lock.acquire(blocking=False):
+            threading.Thread(target=self._load, args=(version,), daemon=True).start()
+
+    def _load(self, version):
+        try:
+            if version is None:
+                self._candidate = None  # Se conservan las estadísticas del último candidato para consultarlas
+                self._has_candidate.clear()
+                return
+            model = self.store.load(version)
+            feature_stats = self.store.info(version).get('metrics', {}).get('feature_stats')
+            self._reset_stats(version)
+            self._drop_old_stats(version)
+            self._candidate = (model, version, feature_stats)
+            self._has_candidate.set()
+        except Exception:
+            pass  # Versión borrada o ilegible: se reintenta en la siguiente comprobación
+        finally:
+            self._load_lock.release()
+
+    # -- Camino de la petición -----------------------------------------------------------------------
+
+    def _start_worker(self):
+        self._pending = deque()
+        self._worker_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._has_candidate = threading.Event()  # Uno nuevo tras el fork: no se hereda el estado del padre
+        if self._candidate is not None:
+            self._has_candidate.set()
+        threading.Thread(target=self._run, daemon=True, name='shadow-evaluator').start()
+
+    def observe(self, rows, predictions):
+        """
+        Encola `rows` (secuencia de filas o matriz) y las `predictions` que devolvió el modelo en servicio para
+        puntuarlas con el candidato. No espera a nada: sin candidato, o con la cola llena, no hace nada más.
+        """
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self.check()
+        if self._candidate is None:
+            return
+        self._worker.get()
+        if len(self._pending) < self.max_pending:
+            self._pending.append((rows, predictions))
+        else:
+            self._dropped += 1
+
+    # -- Hilo de fondo -------------------------------------------------------------------------------
+
+    def _collect(self):
+        batch = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._pending.popleft())
+            except IndexError:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            if self._candidate is None:
+                self._pending.clear()
+                self._publish_stats()
+                self._has_candidate.wait()  # Sin candidato no hay nada que hacer: se duerme hasta que se cargue uno
+                continue
+            batch = self._collect()
+            if not batch:
+                self._publish_stats(idle=True)
+                if time.monotonic() - self._last_check >= self.check_interval:
+                    self.check()  # Sin tráfico, también ve que el candidato se ha promovido o descartado en otro worker
+                time.sleep(self.poll_interval)
+                continue
+            candidate = self._candidate
+            if candidate is None:
+                continue
+            model, version, _ = candidate
+            try:
+                X = np.concatenate([np.atleast_2d(np.asarray(rows, dtype=np.float64)) for rows, _ in batch])
+                served = np.concatenate([np.ravel(np.asarray(p, dtype=np.float64)) for _, p in batch])
+                started = time.perf_counter()
+                shadow = np.ravel(model.predict(X))
+                if self.on_inference is not None:
+                    self.on_inference(time.perf_counter() - started)
+            except Exception:
+                with self._stats_lock:
+                    self._errors += 1
+                continue
+            self._record(version, X, served, shadow)
+            self._publish_stats(idle=True)
+
+    def _record(self, version, X, served, shadow):
+        diff = shadow - served
+        relative = np.abs(diff) / np.maximum(np.abs(served), np.finfo(np.float64).eps)
+        with self._stats_lock:
+            if version != self._version:
+                return  # Lote de un candidato que ya se ha sustituido
+            if self._features is None:
+                self._features = RunningStats(X.shape[1])
+            self._features.update(X)
+            self._predictions.update(np.column_stack([served, shadow, diff, np.abs(diff), relative]))
+            self._rows += len(X)
+
+    # -- Estadísticos compartidos entre workers -----------------------------------------------------
+
+    def _stats_dir(self, version):
+        return os.path.join(self.store.root, 'shadow', version)
+
+    def _snapshot(self):
+        # Estadísticos de este worker, combinables con los de los demás (se llama con _stats_lock cogido)
+        return {'version': self._version, 'rows': self._rows, 'pending': len(self._pending), 'dropped': self._dropped,
+                'errors': self._errors, 'predictions': self._predictions.to_dict(),
+                'features': self._features.to_dict() if self._features is not None else None}
+
+    def _publish_stats(self, idle=False):
+        """Vuelca los estadísticos de este worker a su fichero; con `idle`, como mucho cada publish_interval segundos."""
+        if self._worker_id is None:
+            return
+        with self._stats_lock:
+            if self._version is None or (idle and time.monotonic() - self._last_publish < self.publish_interval):
+                return
+            self._last_publish = time.monotonic()
+            snapshot = self._snapshot()
+        directory = self._stats_dir(snapshot['version'])
+        try:
+            os.makedirs(directory, exist_ok=True)
+            atomic_write(os.path.join(directory, f'{self._worker_id}.json'), json.dumps(snapshot))
+        except OSError:
+            pass  # Sin disco para los estadísticos, stats() sigue teniendo al menos los de este worker
+
+    def _drop_old_stats(self, keep):
+        # Estadísticos de candidatos anteriores: ya no se consultan
+        root = os.path.join(self.store.root, 'shadow')
+        try:
+            names = os.listdir(root)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name != keep:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    def _gather(self):
+        # Estadísticos de todos los workers para el candidato: los de este, en memoria; los demás, de disco
+        with self._stats_lock:
+            local = self._snapshot()
+        version = local['version']
+        if version is None:
+            try:
+                version = self.store.candidate()  # Este worker aún no lo ha cargado, pero otros pueden tener datos
+            except OSError:
+                pass
+        snapshots = [local] if local['version'] == version else []
+        if version is not None:
+            try:
+                names = os.listdir(self._stats_dir(version))
+            except FileNotFoundError:
+                names = []
+            for name in names:
+                if not name.endswith('.json') or name == f'{self._worker_id}.json':
+                    continue
+                try:
+                    with open(os.path.join(self._stats_dir(version), name)) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue  # A medio borrar con el cambio de candidato
+                if snapshot.get('version') == version:
+                    snapshots.append(snapshot)
+        return version, snapshots
+
+    # -- Consulta ------------------------------------------------------------------------------------
+
+    def stats(self):
+        """
+        Estado del candidato, filas puntuadas, diferencias frente al modelo en servicio y deriva de las entradas,
+        sumando los estadísticos de todos los workers ('workers' dice de cuántos; los de los demás llegan con
+        hasta `publish_interval` segundos de retraso).
+        """
+        candidate = self._candidate
+        version, snapshots = self._gather()
+        if candidate is not None and candidate[1] == version:
+            feature_stats = candidate[2]
+        else:
+            try:
+                feature_stats = self.store.info(version).get('metrics', {}).get('feature_stats') if version else None
+            except (OSError, KeyError, ValueError):
+                feature_stats = None
+        p = RunningStats(5)
+        f = None
+        for snapshot in snapshots:
+            p.merge(RunningStats.from_dict(snapshot['predictions']))
+            if snapshot['features'] is not None:
+                features = RunningStats.from_dict(snapshot['features'])
+                if f is None:
+                    f = features
+                else:
+                    f.merge(features)
+        summary = {
+            'candidate': version,
+            'active': candidate is not None and candidate[1] == version,
+            'workers': len(snapshots),
+            'rows': sum(s['rows'] for s in snapshots),
+            'pending': sum(s['pending'] for s in snapshots),
+            'dropped': sum(s['dropped'] for s in snapshots),
+            'errors': sum(s['errors'] for s in snapshots),
+            'served': p.column(0),
+            'shadow': p.column(1),
+            'difference': None,
+            'features': None,
+        }
+        if p.n:
+            summary['difference'] = {
+                'mean': float(p.mean[2]),
+                'std': float(p.std[2]),
+                'rms': float(np.sqrt(p.mean[2] ** 2 + p.std[2] ** 2)),
+                'mean_abs': float(p.mean[3]),
+                'max_abs': float(p.max[3]),
+                'mean_relative_abs': float(p.mean[4]),
+                # Desplazamiento de la predicción media, en desviaciones de las predicciones servidas
+                'mean_shift': _ratio(p.mean[1] - p.mean[0], p.std[0]),
+            }
+        if f is not None and f.n:
+            names = (feature_stats or {}).get('names') or [str(i) for i in range(len(f.mean))]
+            summary['features'] = {}
+            for i, name in enumerate(names[:len(f.mean)]):
+                entry = {'live': f.column(i)}
+                if feature_stats is not None:
+                    train_mean, train_std = feature_stats['mean'][i], feature_stats['std'][i]
+                    # Deriva: media en vivo frente a la de entrenamiento (en desviaciones) y cociente de desviaciones
+                    entry.update(train_mean=train_mean, train_std=train_std,
+                                 mean_shift=_ratio(f.mean[i] - train_mean, train_std),
+                                 std_ratio=_ratio(f.std[i], train_std))
+                summary['features'][name] = entry
+        return summary
@@ -0,0 +1,52 @@
+import os
+
+import pandas as pd
+
+import training
+
+
+def _write_csv(path, n_rows, trailing_newline):
+    data = pd.read_csv(os.path.join(os.path.dirname(__file__), 'data', 'Advertising_new.csv')).head(n_rows)
+    text = data.to_csv(index=False)
+    path.write_text(text if trailing_newline else text.rstrip('\n'))
+    return data
+
+
+def test_incremental_reads_last_line_without_newline(tmp_path):
+    csv_path = tmp_path / 'ads.csv'
+    _write_csv(csv_path, 100, trailing_newline=False)
+    state_path = str(tmp_path / 'state.npz')
+
+    _, scores = training.train_incremental(str(csv_path), state_path)
+
+    assert scores['rows'] == 100
+    assert scores['ingest'] == 'rebuild'
+
+
+def test_incremental_appends_after_last_line_without_newline(tmp_path):
+    csv_path = tmp_path / 'ads.csv'
+    data = _write_csv(csv_path, 100, trailing_newline=False)
+    state_path = str(tmp_path / 'state.npz')
+    training.train_incremental(str(csv_path), state_path)
+
+    with open(csv_path, 'a') as f:
+        f.write('\n' + data.head(5).to_csv(index=False, header=False))
+    _, scores = training.train_incremental(str(csv_path), state_path)
+
+    assert scores['ingest'] == 'append'
+    assert scores['rows'] == 105
+
+
+def test_incremental_rebuilds_when_last_line_was_still_being_written(tmp_path):
+    csv_path = tmp_path / 'ads.csv'
+    data = _write_csv(csv_path, 100, trailing_newline=False)
+    state_path = str(tmp_path / 'state.npz')
+    training.train_incremental(str(csv_path), state_path)
+
+    # La última línea leída sin \n no estaba completa: se le añaden caracteres antes del \n
+    with open(csv_path, 'a') as f:
+        f.write('5\n' + data.head(5).to_csv(index=False, header=False))
+    _, scores = training.train_incremental(str(csv_path), state_path)
+
+    assert scores['ingest'] == 'rebuild'
+    assert scores['rows'] == 105
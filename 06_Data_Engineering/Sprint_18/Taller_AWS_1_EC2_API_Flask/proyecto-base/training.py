@@ -0,0 +1,334 @@
+import hashlib
+import io
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import Lasso
+from sklearn.metrics import mean_squared_error, mean_absolute_percentage_error
+from sklearn.model_selection import train_test_split
+
+from atomic_io import atomic_write
+from data_cache import load_frame
+from tuning import tune_lasso
+
+# Dependencias de entrenamiento (pandas y scikit-learn): este módulo sólo se importa al reentrenar,
+# así que los workers que únicamente predicen no las cargan al arrancar
+
+TARGET = 'sales'
+ALPHA = 6000
+TEST_SIZE = 0.20
+
+
+def train(path, tune=False, criterion='rmse', n_jobs=None):
+    """
+    Entrena el Lasso con los datos de `path`, lo evalúa en un split de test y lo reajusta con todos los datos.
+
+    Con `tune`, alpha no es el fijo (ALPHA) sino el que elige tuning.tune_lasso por validación cruzada
+    sobre train según `criterion` ('rmse' o 'mape'); su diagnóstico queda en model.tuning_ y se publica con el artefacto.
+    Los datos se leen de la caché columnar (data_cache.py): si el CSV no ha cambiado no se vuelve a parsear.
+    """
+    data = load_frame(path)
+
+    X_train, X_test, y_train, y_test = train_test_split(data.drop(columns=[TARGET]),
+                                                    data[TARGET],
+                                                    test_size = TEST_SIZE,
+                                                    random_state=42)
+
+    tuning = tune_lasso(X_train, y_train, cv=4, criterion=criterion, n_jobs=n_jobs) if tune else None
+    alpha = tuning['alpha'] if tune else ALPHA
+
+    model = Lasso(alpha=alpha)
+    model.fit(X_train, y_train)
+    y_pred = model.predict(X_test)
+    rmse = np.sqrt(mean_squared_error(y_test, y_pred))
+    mape = mean_absolute_percentage_error(y_test, y_pred)
+    model.fit(data.drop(columns=[TARGET]), data[TARGET])
+
+    scores = {'rmse': float(rmse), 'mape': float(mape), 'feature_stats': feature_stats(data.drop(columns=[TARGET]))}
+    if tune:
+        model.tuning_ = tuning
+        scores.update(alpha=alpha, criterion=criterion, best_at_edge=tuning['best_at_edge'],
+                      grid_extensions=tuning['grid_extensions'])
+    return model, scores
+
+
+def feature_stats(X):
+    """Media y desviación de cada feature de entrenamiento: la referencia con la que el modo sombra mide la deriva."""
+    return {'names': [str(c) for c in X.columns], 'mean': X.mean().tolist(), 'std': X.std(ddof=0).tolist()}
+
+
+## REENTRENAMIENTO INCREMENTAL ##
+
+INCREMENTAL_STATE_VERSION = 2
+CHUNK_BYTES = 8 * 1024 * 1024  # Bytes del CSV que se parsean de una vez
+MAPE_SAMPLE = 10000            # Filas de test que se guardan (como máximo) para calcular el MAPE
+_FINGERPRINT_BYTES = 4096     # Bytes antes del offset con los que se comprueba que el CSV sólo ha crecido por el final
+TAIL_SETTLE_SECONDS = 2.0      # Sin cambios en el CSV durante este tiempo, su última línea sin \n se da por completa
+
+
+class SufficientStats:
+    """
+    Estadísticos suficientes de un conjunto de filas para ajustar un modelo lineal: n, sumas de X y de y,
+    XᵀX, Xᵀy e yᵀy. Se actualizan fila a fila (o por bloques) y dos conjuntos se combinan sumándolos.
+    """
+
+    def __init__(self, n_features):
+        self.n = 0
+        self.sum_x = np.zeros(n_features)
+        self.sum_y = 0.0
+        self.xtx = np.zeros((n_features, n_features))
+        self.xty = np.zeros(n_features)
+        self.yty = 0.0
+
+    def update(self, X, y):
+        self.n += len(y)
+        self.sum_x += X.sum(axis=0)
+        self.sum_y += float(y.sum())
+        self.xtx += X.T @ X
+        self.xty += X.T @ y
+        self.yty += float(y @ y)
+
+    def __add__(self, other):
+        total = SufficientStats(len(self.sum_x))
+        for name in ('n', 'sum_x', 'sum_y', 'xtx', 'xty', 'yty'):
+            setattr(total, name, getattr(self, name) + getattr(other, name))
+        return total
+
+    def sse(self, coef, intercept):
+        """Suma de los errores al cuadrado de y ≈ X·coef + intercept en estas filas, sin tenerlas: sólo con los estadísticos."""
+        return float(self.yty - 2 * coef @ self.xty - 2 * intercept * self.sum_y + coef @ self.xtx @ coef
+                     + 2 * intercept * coef @ self.sum_x + self.n * intercept ** 2)
+
+    def to_arrays(self, prefix):
+        return {f'{prefix}_{name}': np.asarray(getattr(self, name)) for name in ('n', 'sum_x', 'sum_y', 'xtx', 'xty', 'yty')}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        stats = cls(len(arrays[f'{prefix}_sum_x']))
+        stats.n = int(arrays[f'{prefix}_n'])
+        stats.sum_y = float(arrays[f'{prefix}_sum_y'])
+        stats.yty = float(arrays[f'{prefix}_yty'])
+        for name in ('sum_x', 'xtx', 'xty'):
+            setattr(stats, name, np.array(arrays[f'{prefix}_{name}'], dtype=np.float64))
+        return stats
+
+
+def lasso_from_stats(stats, alpha, coef_init=None, tol=1e-10, max_iter=10000):
+    """
+    Ajusta un Lasso con intercept (el mismo objetivo que sklearn: ||y - Xw - b||² / (2n) + alpha·||w||₁)
+    a partir de los estadísticos suficientes, por descenso por coordenadas sobre la matriz de Gram centrada.
+
+    Cada pasada cuesta O(p²) con p features, sin tocar las filas. Con `coef_init` (los coeficientes del
+    reentrenamiento anterior) se parte de una solución casi óptima y converge en pocas pasadas.
+    Devuelve (coef, intercept).
+    """
+    mean_x = stats.sum_x / stats.n
+    mean_y = stats.sum_y / stats.n
+    gram = stats.xtx - stats.n * np.outer(mean_x, mean_x)   # Xcᵀ Xc
+    corr = stats.xty - stats.n * mean_x * mean_y            # Xcᵀ yc
+    threshold = stats.n * alpha
+
+    coef = np.zeros(len(corr)) if coef_init is None else np.array(coef_init, dtype=np.float64)
+    for _ in range(max_iter):
+        max_step = 0.0
+        for j in range(len(coef)):
+            if gram[j, j] <= 0:
+                continue
+            rho = corr[j] - gram[j] @ coef + gram[j, j] * coef[j]
+            new = np.sign(rho) * max(abs(rho) - threshold, 0.0) / gram[j, j]
+            max_step = max(max_step, abs(new - coef[j]))
+            coef[j] = new
+        if max_step <= tol * max(1.0, np.abs(coef).max()):
+            break
+    return coef, mean_y - mean_x @ coef
+
+
+def _row_hash(row_ids, multiplier):
+    # Número en [0, 1) fijo para cada número de fila (hash multiplicativo), así no depende de cómo se trocee el CSV
+    return ((row_ids.astype(np.uint64) * np.uint64(multiplier)) >> np.uint64(11)) / float(2 ** 53)
+
+
+def _holdout_mask(row_ids, test_size):
+    # Reparto train/test por número de fila
+    return _row_hash(row_ids, 0x9E3779B97F4A7C15) < test_size
+
+
+def _keep_sample(state, X, y, row_ids):
+    """
+    Añade filas de test a la muestra para el MAPE y se queda con las MAPE_SAMPLE de menor clave (otro hash del
+    número de fila): es una muestra uniforme que no depende del troceado y cuyo tamaño no crece con el CSV.
+    """
+    keys = np.concatenate([state['holdout_key'], _row_hash(row_ids, 0xC2B2AE3D27D4EB4F)])
+    X = np.concatenate([state['X_holdout'], X])
+    y = np.concatenate([state['y_holdout'], y])
+    if len(keys) > MAPE_SAMPLE:
+        keep = np.argpartition(keys, MAPE_SAMPLE - 1)[:MAPE_SAMPLE]
+        keys, X, y = keys[keep], X[keep], y[keep]
+    state['holdout_key'], state['X_holdout'], state['y_holdout'] = keys, X, y
+
+
+def _fingerprint(f, offset):
+    start = max(0, offset - _FINGERPRINT_BYTES)
+    f.seek(start)
+    return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+
+def _parse_rows(data, n_columns):
+    if not data.strip():  # Sólo saltos de línea, p. ej. el \n que completa una última línea ya leída
+        return np.empty((0, n_columns))
+    rows = pd.read_csv(io.BytesIO(data), header=None, dtype=np.float64).to_numpy()
+    if rows.shape[1] != n_columns:
+        raise ValueError(f"Expected {n_columns} columns in the appended rows, got {rows.shape[1]}")
+    return rows
+
+
+def _read_appended(f, offset, n_columns, tail=False):
+    """
+    Lee del CSV, desde `offset`, las líneas completas en bloques. Devuelve [(offset final, matriz)] de forma perezosa.
+
+    Una última línea sin \n puede estar escribiéndose todavía y se deja para la próxima, salvo con `tail`
+    (el fichero se da por terminado), en que se lee también, como hace read_csv en train().
+    """
+    f.seek(offset)
+    pending = b''
+    while True:
+        block = f.read(CHUNK_BYTES)
+        if not block:
+            if tail and pending.strip():
+                yield offset + len(pending), _parse_rows(pending, n_columns)
+            return
+        data = pending + block
+        end = data.rfind(b'\n') + 1
+        pending = data[end:]
+        offset += end
+        if end:
+            yield offset, _parse_rows(data[:end], n_columns)
+
+
+def _tail_settled(f):
+    return time.time() - os.fstat(f.fileno()).st_mtime >= TAIL_SETTLE_SECONDS
+
+
+def _line_extended(f, offset):
+    # Si el estado acabó en una última línea sin \n y después se le han añadido caracteres (se estaba
+    # escribiendo), la fila leída no es la del fichero: el byte siguiente tiene que ser \n o el final
+    f.seek(max(0, offset - 1))
+    previous, following = f.read(1), f.read(1)
+    return previous != b'\n' and following not in (b'', b'\n', b'\r')
+
+
+def _new_state(path, alpha, test_size):
+    with open(path, 'rb') as f:
+        header = f.readline()
+    columns = header.decode().strip().split(',')
+    features = [c for c in columns if c != TARGET]
+    return {
+        'version': INCREMENTAL_STATE_VERSION, 'columns': columns, 'features': features,
+        'alpha': alpha, 'test_size': test_size, 'offset': len(header), 'rows': 0, 'fingerprint': None,
+        'train': SufficientStats(len(features)), 'test': SufficientStats(len(features)),
+        'X_holdout': np.empty((0, len(features))), 'y_holdout': np.empty(0), 'holdout_key': np.empty(0),
+        'coef_train': None, 'coef_all': None,
+    }
+
+
+def _load_state(state_path, path, alpha, test_size):
+    # Devuelve None (y se reentrena desde cero) si no hay estado, es de otra versión u otros parámetros,
+    # o el CSV no es el mismo fichero con filas añadidas al final (se ha recortado o reescrito)
+    if not os.path.exists(state_path):
+        return None
+    with np.load(state_path, allow_pickle=False) as arrays:
+        meta = json.loads(str(arrays['meta']))
+        if (meta['version'] != INCREMENTAL_STATE_VERSION or meta['alpha'] != alpha
+                or meta['test_size'] != test_size or os.path.getsize(path) < meta['offset']):
+            return None
+        with open(path, 'rb') as f:
+            if _fingerprint(f, meta['offset']) != meta['fingerprint'] or _line_extended(f, meta['offset']):
+                return None
+        state = dict(meta)
+        state['train'] = SufficientStats.from_arrays(arrays, 'train')
+        state['test'] = SufficientStats.from_arrays(arrays, 'test')
+        for name in ('X_holdout', 'y_holdout', 'holdout_key', 'coef_train', 'coef_all'):
+            state[name] = np.array(arrays[name])
+    return state
+
+
+def _save_state(state, state_path):
+    meta = {k: state[k] for k in ('version', 'columns', 'features', 'alpha', 'test_size', 'offset', 'rows', 'fingerprint')}
+    arrays = {**state['train'].to_arrays('train'), **state['test'].to_arrays('test')}
+    buffer = io.BytesIO()
+    np.savez(buffer, meta=json.dumps(meta), X_holdout=state['X_holdout'], y_holdout=state['y_holdout'],
+             holdout_key=state['holdout_key'], coef_train=state['coef_train'], coef_all=state['coef_all'], **arrays)
+    atomic_write(state_path, buffer.getvalue())
+
+
+def train_incremental(path, state_path='retrain_state.npz', alpha=None, test_size=TEST_SIZE):
+    """
+    Como train(), pero sin releer ni reajustar desde cero: lee del CSV sólo las filas añadidas desde el
+    último reentrenamiento (a partir del offset en bytes guardado en `state_path`), las suma a los
+    estadísticos suficientes (XᵀX, Xᵀy...) de train y de test, y reajusta los dos Lasso (el de evaluación
+    y el final, con todos los datos) con descenso por coordenadas partiendo de los coeficientes anteriores.
+
+    El coste depende de las filas nuevas, no del tamaño del CSV. El test es un `test_size` de las filas elegido
+    por número de fila (no el train_test_split(random_state=42) de train(), así que sus RMSE y MAPE no son
+    comparables con los de mode=full; las métricas lo indican con holdout='row_hash'). El RMSE es exacto y sale
+    de los estadísticos de test; el MAPE, que no se puede obtener de ellos, se calcula sobre una muestra fija
+    de hasta MAPE_SAMPLE filas de test guardada en el estado (exacto mientras haya menos).
+    Si no hay estado o el CSV no es el anterior más filas añadidas, se reconstruye todo leyéndolo entero,
+    y lo mismo si cambia `alpha` (por defecto ALPHA; la API pasa el del modelo en servicio, p. ej. uno ajustado con tune).
+    """
+    alpha = ALPHA if alpha is None else alpha
+    state = _load_state(state_path, path, alpha, test_size)
+    ingest = 'append'
+    if state is None:
+        state, ingest = _new_state(path, alpha, test_size), 'rebuild'
+
+    target = state['columns'].index(TARGET)
+    feature_idx = [i for i, c in enumerate(state['columns']) if c != TARGET]
+    new_rows = 0
+    with open(path, 'rb') as f:
+        # La última línea sin \n se lee al reconstruir (como train()) o si el CSV lleva un rato sin cambiar
+        tail = ingest == 'rebuild' or _tail_settled(f)
+        for offset, rows in _read_appended(f, state['offset'], len(state['columns']), tail):
+            X, y = rows[:, feature_idx], rows[:, target]
+            row_ids = np.arange(state['rows'], state['rows'] + len(rows))
+            test = _holdout_mask(row_ids, test_size)
+            state['train'].update(X[~test], y[~test])
+            state['test'].update(X[test], y[test])
+            _keep_sample(state, X[test], y[test], row_ids[test])
+            state['rows'] += len(rows)
+            state['offset'] = offset
+            new_rows += len(rows)
+        state['fingerprint'] = _fingerprint(f, state['offset'])
+
+    if state['train'].n == 0:
+        raise ValueError(f"No training rows in {path}")
+    state['coef_train'], intercept_train = lasso_from_stats(state['train'], alpha, state['coef_train'])
+    state['coef_all'], intercept_all = lasso_from_stats(state['train'] + state['test'], alpha, state['coef_all'])
+
+    rmse = mape = None
+    if state['test'].n:
+        rmse = float(np.sqrt(max(state['test'].sse(state['coef_train'], intercept_train), 0.0) / state['test'].n))
+        y_pred = state['X_holdout'] @ state['coef_train'] + intercept_train
+        mape = float(mean_absolute_percentage_error(state['y_holdout'], y_pred))
+
+    # Un Lasso de sklearn "ajustado" con los coeficientes calculados: se publica, pickla y exporta igual que el de train()
+    model = Lasso(alpha=alpha)
+    model.coef_ = state['coef_all'].copy()
+    model.intercept_ = float(intercept_all)
+    model.n_features_in_ = len(state['features'])
+    model.feature_names_in_ = np.array(state['features'], dtype=object)
+    model.n_iter_ = 0
+    model.dual_gap_ = 0.0
+
+    # Media y desviación de las features a partir de los estadísticos suficientes, sin releer las filas
+    total = state['train'] + state['test']
+    mean_x = total.sum_x / total.n
+    std_x = np.sqrt(np.maximum(np.diag(total.xtx) / total.n - mean_x ** 2, 0.0))
+    stats = {'names': list(state['features']), 'mean': mean_x.tolist(), 'std': std_x.tolist()}
+
+    _save_state(state, state_path)
+    return model, {'rmse': rmse, 'mape': mape, 'alpha': alpha, 'ingest': ingest, 'rows': state['rows'], 'new_rows': new_rows,
+                   'holdout': 'row_hash', 'mape_rows': len(state['y_holdout']), 'feature_stats': stats}
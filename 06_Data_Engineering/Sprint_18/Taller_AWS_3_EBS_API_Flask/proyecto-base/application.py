@@ -1,5 +1,18 @@
+import os
+import sys
+
 from flask import Flask
 
+# El núcleo de servicio del modelo (serving.py y sus módulos) vive en la API de EC2. En el bundle de Elastic
+# Beanstalk (make_bundle.py) se copia junto a este fichero; en el repositorio se importa desde aquella carpeta
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVING_CORE_DIR = os.environ.get('SERVING_CORE_DIR', os.path.join(
+    HERE, '..', '..', 'Taller_AWS_1_EC2_API_Flask', 'proyecto-base'))
+if not os.path.exists(os.path.join(HERE, 'serving.py')):
+    sys.path.insert(0, os.path.abspath(SERVING_CORE_DIR))
+
+from serving import ServingCore  # noqa: E402
+
 # print a nice greeting.
 def say_hello(username = "World"):
     return '<p>Hello %s!</p>\n' % username
@@ -23,6 +36,14 @@ application.add_url_rule('/', 'index', (lambda: header_text +
 application.add_url_rule('/<username>', 'hello', (lambda username:
     header_text + say_hello(username) + home_link + footer_text))
 
+# Mismo servicio del modelo advertising que en EC2: /api/v1/predict, /api/v1/predict/batch, /api/v1/models,
+# /api/v1/shadow, /healthz y /readyz (para el health check del balanceador) y /metrics. Sirve el ad_model.json
+# del bundle o, si no lo hay, el de la API de EC2; el reentrenamiento sigue siendo cosa de la instancia EC2
+MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(HERE, 'ad_model.json') if os.path.exists(
+    os.path.join(HERE, 'ad_model.json')) else os.path.join(os.path.abspath(SERVING_CORE_DIR), 'ad_model.json'))
+core = ServingCore(model_path=MODEL_PATH)
+core.init_app(application)
+
 # run the app.
 if __name__ == "__main__":
 
@@ -0,0 +1,41 @@
+"""
+Empaqueta la API para Elastic Beanstalk: application.py, requirements.txt, el núcleo de servicio de la API
+de EC2 (serving.MODULES) y el modelo ad_model.json, en un zip listo para subir como nueva versión.
+
+    python make_bundle.py                     # -> application-v1.zip
+    python make_bundle.py -o application-v2.zip
+"""
+import argparse
+import os
+import sys
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORE_DIR = os.path.abspath(os.environ.get('SERVING_CORE_DIR', os.path.join(
+    HERE, '..', '..', 'Taller_AWS_1_EC2_API_Flask', 'proyecto-base')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default='application-v1.zip')
+    args = parser.parse_args()
+
+    sys.path.insert(0, CORE_DIR)
+    from serving import MODULES  # La lista de ficheros del núcleo la mantiene serving.py
+
+    files = [(os.path.join(HERE, name), name) for name in ('application.py', 'requirements.txt')]
+    files += [(os.path.join(CORE_DIR, name), name) for name in MODULES + ['ad_model.json']]
+    with zipfile.ZipFile(os.path.join(HERE, args.output), 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for path, name in files:
+            bundle.write(path, name)
+        # Configuración de Elastic Beanstalk de la versión anterior (.ebextensions), si se tiene a mano
+        ebextensions = os.path.join(HERE, '.ebextensions')
+        for root, _, names in os.walk(ebextensions):
+            for name in names:
+                path = os.path.join(root, name)
+                bundle.write(path, os.path.relpath(path, HERE))
+    print(f"{args.output}: {len(files)} files")
+
+
+if __name__ == '__main__':
+    main()